@@ -0,0 +1,276 @@
+import os
+import json
+import time
+
+from dataclasses import dataclass
+
+from datafile import Datafile, DatafileParser
+from sink import openSink
+from logfile import Logfile, LogfileParser, CarvingProcess, carvingPool
+
+@dataclass
+class BatchJob:
+    jobid: int = 0
+    datafile: str = ''
+    logfile: str = ''
+    mode: int = 0
+    hitfile: str = ''
+    output: str = ''
+    format: str = 'csv'
+    keyonly: bool = False
+    iam: bool = False
+    columns: dict = None
+    secondaries: list = None
+    status: str = 'pending'
+    elapsed: float = 0.0
+    message: str = ''
+
+def loadCatalog(datafile, iam=False, secondaries=None):
+    df = Datafile()
+    if df.open(datafile) == 1:
+        return None
+    dp = DatafileParser(df)
+    # secondary data files (.ndf), registered by the file id in their page 0 header
+    for secondary in secondaries or []:
+        if dp.files.add(secondary) != True:
+            dp.files.close()
+            df.close()
+            return None
+    # catalog pages from the boot page (page chains, or IAM chains with iam) instead of reading every page,
+    # .json page map / full scan when the boot page is unusable
+    if (dp.scanAllocationPages() if iam else dp.scanCatalogPages()) != True:
+        dp.pages.clear()
+        dp.scanPages(datafile)
+    dp.getSystemTableColumnInfo()
+    if dp.getTableInfo() != True:
+        df.close()
+        return None
+    dp.getColumnInfo()
+    dp.getKeyColumninfo()
+    dp.getPageObjectId() # Extract table information
+    return dp
+
+def loadProjection(specs):
+    # column projection per table: JSON files ({"table": ["col", ...]}) or "table:col,col" specs
+    columns = dict()
+    for spec in specs or []:
+        if os.path.isfile(spec):
+            try:
+                with open(spec, 'r') as f:
+                    entries = json.load(f)
+            except:
+                print('Projection open error : ' + spec)
+                return None
+            for tablename, colnames in entries.items():
+                columns.setdefault(tablename, set()).update(colnames)
+        elif ':' in spec:
+            tablename, colnames = spec.split(':', 1)
+            columns.setdefault(tablename, set()).update(x.strip() for x in colnames.split(',') if x.strip())
+        else:
+            print('Invalid projection : ' + spec)
+            return None
+    return columns
+
+def runJob(mode, logfile, dp=None, pool=None, workers=None, hitfile=None, sink=None, recoveryworkers=None, keyonly=False, columns=None, history=None):
+    # 0b00 = only LDF, 0b01 = LDF with MDF, 0b10 = only unallocated area, 0b11 = unallocated area with MDF
+    # 0b1xx = unallocated area carved by whole log blocks
+    if mode & 2:
+        cp = CarvingProcess(logfile, 4096, numofprocess=workers)
+        if cp.open() == 1:
+            return None
+        partitionids = None
+        if mode & 1:
+            partitionids = set(x.partitionid for x in dp.tablelist if x.partitionid != 0)
+        if mode & 4:
+            cp.processBlocks(pool)
+        else:
+            cp.process(hitfile, pool, partitionids)
+        if mode & 1:
+            cp.recovery(dp, sink, keyonly, columns)
+        cp.close()
+        return cp
+    else:
+        lf = Logfile()
+        if lf.open(logfile) == 1:
+            return None
+        lp = LogfileParser(lf, dp if mode & 1 else None)
+        lp.scanVLFs()
+        lp.scanLogSegment()
+        lp.parseVLF()
+        if mode & 1 and history is not None:
+            # versions of one row (partitionid, pageid, slotid, fileid) instead of the whole log
+            for lsn, op, begintime, endtime, coldata in lp.rowHistory(*history):
+                print('{:08x}:{:08x}:{:04x} {} {} {} {}'.format(*lsn, op.name, begintime, endtime, ', '.join(coldata) if coldata else '(unknown)'))
+        elif mode & 1:
+            lp.recovery(sink, recoveryworkers, keyonly, columns, pool)
+        lf.close()
+        return lp
+
+def runBatchJob(job, catalogs, pool=None, recoveryworkers=None):
+    # False when the job was cancelled with Ctrl-C
+    print('[Batch] Job {} start (mode {})'.format(job.jobid, job.mode))
+    job.status = 'running'
+    start_time = time.time()
+    try:
+        executeJob(job, catalogs, pool, recoveryworkers)
+    except KeyboardInterrupt:
+        # outside carving (catalog, recovery): the output written so far is closed by executeJob
+        job.status = 'cancelled'
+        job.message = 'partial result'
+    except Exception as e:
+        job.status = 'failed'
+        job.message = str(e)
+    job.elapsed = time.time() - start_time
+    print('[Batch] Job {} {} ({:.1f} sec)'.format(job.jobid, job.status, job.elapsed))
+    return job.status != 'cancelled'
+
+def executeJob(job, catalogs, pool=None, recoveryworkers=None):
+    # catalogs: abspath of MDF -> DatafileParser, shared by the jobs of one MDF
+    dp = None
+    if job.mode & 1:
+        if job.datafile not in catalogs:
+            catalogs[job.datafile] = loadCatalog(job.datafile, job.iam, job.secondaries)
+        dp = catalogs[job.datafile]
+        if dp is None:
+            job.status = 'failed'
+            job.message = 'table information not found'
+            return
+
+    sink = None
+    if job.output:
+        sink = openSink(job.output, job.format)
+        if sink is None:
+            job.status = 'failed'
+            job.message = 'output open error'
+            return
+    try:
+        result = runJob(job.mode, job.logfile, dp, pool, hitfile=job.hitfile or None, sink=sink, recoveryworkers=recoveryworkers, keyonly=job.keyonly, columns=job.columns)
+    finally:
+        if sink is not None:
+            sink.close()
+    if result is None:
+        job.status = 'failed'
+        job.message = 'file open error'
+    elif getattr(result, 'cancelled', False):
+        # Ctrl-C during carving: this job keeps its partial hits, the remaining jobs are not started
+        job.status = 'cancelled'
+        job.message = 'partial result'
+    else:
+        job.status = 'done'
+
+def closeCatalogs(catalogs):
+    for dp in catalogs.values():
+        if dp is not None:
+            dp.files.close()
+            dp.mssql.close()
+
+def _runJobGroup(jobs):
+    # pool worker: jobs of one MDF back to back, its catalog parsed once; recovery is serial in a worker
+    catalogs = dict()
+    try:
+        for job in jobs:
+            runBatchJob(job, catalogs)
+    finally:
+        closeCatalogs(catalogs)
+    return [(job.status, job.message, job.elapsed) for job in jobs]
+
+class BatchRunner():
+    def __init__(self, manifest, cpus=None):
+        self.manifest = manifest
+        self.cpus = cpus if cpus else (os.cpu_count() or 1)
+        self.jobs = list()
+        self.catalogs = dict() # abspath of MDF -> DatafileParser
+        self.pool = None
+        self.cancelled = False
+
+    def load(self):
+        # manifest: [{"data": "a.mdf", "log": "a.ldf", "mode": 1, "output": "a.csv"}, ...], paths relative to the manifest
+        basedir = os.path.dirname(os.path.abspath(self.manifest))
+        try:
+            with open(self.manifest, 'r') as f:
+                entries = json.load(f)
+        except:
+            print('Manifest open error : ' + self.manifest)
+            return False
+
+        for i, entry in enumerate(entries):
+            job = BatchJob()
+            job.jobid = i
+            job.mode = int(entry.get('mode', 0))
+            job.keyonly = bool(entry.get('keyonly', False))
+            job.iam = bool(entry.get('iam', False))
+            if entry.get('columns'):
+                job.columns = entry['columns']
+            if entry.get('data'):
+                job.datafile = os.path.abspath(os.path.join(basedir, entry['data']))
+            if entry.get('ndf'):
+                job.secondaries = [os.path.abspath(os.path.join(basedir, x)) for x in entry['ndf']]
+            if entry.get('log'):
+                job.logfile = os.path.abspath(os.path.join(basedir, entry['log']))
+            if entry.get('hitindex'):
+                job.hitfile = os.path.abspath(os.path.join(basedir, entry['hitindex']))
+            if entry.get('output'):
+                job.output = os.path.abspath(os.path.join(basedir, entry['output']))
+                job.format = entry.get('format', 'csv')
+            self.jobs.append(job)
+        return True
+
+    def run(self):
+        # one worker pool for the whole batch, sized by the CPU budget. Jobs without carving are grouped by MDF
+        # (the group shares one parsed catalog) and each group runs in a pool worker; carving jobs run here and
+        # hand their ranges to the pool. A single group runs here too, its recovery chunks on the pool, and so does
+        # the group of an MDF that carving jobs recover from, so that its catalog is parsed once.
+        self.pool = carvingPool(self.cpus)
+        groups = dict()
+        carvingjobs = []
+        for job in sorted(self.jobs, key=lambda x: (x.datafile, x.jobid)):
+            if job.mode & 2:
+                carvingjobs.append(job)
+            else:
+                groups.setdefault(job.datafile if job.mode & 1 else ('', job.jobid), []).append(job)
+
+        carvingfiles = set(job.datafile for job in carvingjobs if job.mode & 1)
+        localjobs = []
+        single = len(groups) == 1
+        for key in list(groups):
+            if single or key in carvingfiles:
+                localjobs += groups.pop(key)
+        pending = [(jobs, self.pool.apply_async(_runJobGroup, (jobs,))) for jobs in groups.values()]
+
+        for job in sorted(localjobs + carvingjobs, key=lambda x: (x.datafile, x.jobid)):
+            if self.cancelled:
+                job.status = 'cancelled'
+                continue
+            if runBatchJob(job, self.catalogs, self.pool, self.cpus) is False:
+                self.cancelled = True
+        self._collect(pending)
+
+        if self.cancelled:
+            self.pool.terminate() # drop the ranges and job groups still queued
+        self.pool.close()
+        self.pool.join()
+        self.pool = None
+        closeCatalogs(self.catalogs)
+
+    def _collect(self, pending):
+        # status of the job groups run by the pool, the groups still running are dropped on Ctrl-C
+        for jobs, result in pending:
+            outcomes = None
+            if not self.cancelled or result.ready():
+                try:
+                    outcomes = result.get()
+                except KeyboardInterrupt:
+                    self.cancelled = True
+                except Exception as e:
+                    outcomes = [('failed', str(e), 0.0)] * len(jobs)
+            for job, outcome in zip(jobs, outcomes or [('cancelled', 'not finished', 0.0)] * len(jobs)):
+                job.status, job.message, job.elapsed = outcome
+
+    def report(self, filename=None):
+        print('{:>4} {:>4} {:>8} {:>10}  {}'.format('Job', 'Mode', 'Status', 'Time(sec)', 'Log'))
+        for job in self.jobs:
+            print('{:>4} {:>4} {:>8} {:>10.1f}  {} {}'.format(job.jobid, job.mode, job.status, job.elapsed, job.logfile, job.message))
+
+        if filename is not None:
+            with open(filename, 'w') as f:
+                json.dump([job.__dict__ for job in self.jobs], f, indent=2)
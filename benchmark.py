@@ -0,0 +1,45 @@
+import os
+import time
+import random
+import argparse
+
+from logfile import np, scanSig, _scanSigRegex
+
+def makeImage(size, numofrecord):
+    # random data with INSERT_ROWS / BEGIN_XACT / COMMIT_XACT headers planted at 4-byte boundaries
+    buf = bytearray(os.urandom(size))
+    headers = [(b'\x00\x00\x3E\x00', 0x02), (b'\x40\x00\x4C\x00', 0x80), (b'\x48\x00\x50\x00', 0x81)]
+    for _ in range(numofrecord):
+        offset = random.randrange(0, size - 0x40) & ~0x03
+        sig, op = random.choice(headers)
+        buf[offset:offset + 0x04] = sig
+        buf[offset + 0x16] = op
+    return bytes(buf)
+
+def benchScan(name, func, buf, size, repeat):
+    elapsed = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        offsetList = func(buf, size)
+        elapsed.append(time.perf_counter() - start_time)
+
+    best = min(elapsed)
+    print('{}: {} MB, {} hits, {:.3f} sec, {:.2f} GB/s'.format(name, size >> 20, len(offsetList), best, size / best / (1 << 30)))
+
+def benchScanSig(size, numofrecord, repeat):
+    buf = makeImage(size, numofrecord)
+    if np is not None:
+        benchScan('scanSig(numpy)', scanSig, buf, size, repeat)
+    benchScan('scanSig(regex)', _scanSigRegex, buf, size, repeat)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-s", "--size", dest="size", action="store", type=int, default=64) # MB
+    parser.add_argument("-n", "--records", dest="records", action="store", type=int, default=1000)
+    parser.add_argument("-r", "--repeat", dest="repeat", action="store", type=int, default=3)
+    args = parser.parse_args()
+
+    benchScanSig(args.size << 20, args.records, args.repeat)
+
+if __name__ == "__main__":
+    main()
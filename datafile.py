@@ -1,12 +1,14 @@
 import os
 import enum
+import mmap
 import math
 import json
 
 from ctypes import *
 from struct import *
 from dataclasses import dataclass
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 class _MSSQLPageHeaer(LittleEndianStructure):
     _fields_ = [
@@ -77,12 +79,67 @@ class TableInfo:
     pobjectid: int = 0
     partitionid: int = 0
 
+@dataclass(order=True)
+class AllocUnitInfo:
+    auid: int = 0
+    type: int = 0 # 1 = in-row data, 2 = LOB data, 3 = row-overflow data
+    ownerid: int = 0 # partition (rowset) id
+    status: int = 0
+    fgid: int = 0
+    pgfirst: int = 0
+    pgroot: int = 0
+    rootfileid: int = 1
+    pgfirstiam: int = 0
+
+@dataclass(order=True)
+class KeyColumn:
+    datatype: str = ''
+    colsize: int = 0
+    rowoffset: int = 0 # offset in the data row
+    colorder: int = 0
+
+@dataclass(order=True)
+class KeyLayout:
+    columns: list = None # KeyColumn, in key order
+    numoftotalcol: int = 0
+    fixedend: int = 0 # offset of the column count in a data row (end of the fixed-length part)
+
+BOOT_PAGE = 9
+FIRSTSYSINDEXES_OFFSETS = [0x60 + 0x264, 0x264] # dbi_firstSysIndexes in the boot page (first sysallocunits page)
+PAGE_TYPE_DATA = 1
+PAGE_TYPE_INDEX = 2
+PAGE_TYPE_IAM = 10
+MAX_INDEX_DEPTH = 16
+INDEX_CACHE = 1024 # index pages kept for key seeks
+MAX_OPEN_FILES = 32 # data files open at once
+READ_BATCH = 1024 # pages fetched per readPages call
+LOB_CACHE_SIZE = 64 * 1024 * 1024 # bytes of text / LOB pages kept for off-row values
+MAX_LOB_DEPTH = 16
+# in-row pointers of off-row values (complex columns)
+BLOB_ROW_OVERFLOW = 2
+BLOB_INLINE_ROOT = 4
+TEXT_POINTER_SIZE = 16 # timestamp (8 bytes) + row id
+# LOB fragment records on text pages
+LOB_SMALL_ROOT = 0
+LOB_INTERNAL = 2
+LOB_DATA = 3
+LOB_LARGE_ROOT_YUKON = 5
+GAM_INTERVAL = 511232 # pages covered by one GAM / IAM page
+IAM_STARTPAGE = 0x88
+IAM_SINGLEPAGES = 0x8E # 8 single page allocations (mixed extents)
+ALLOC_BITMAP = 0xC2 # extent bitmap of IAM / GAM pages
+ALLOC_BITMAP_SIZE = GAM_INTERVAL // 64 # one bit per extent of 8 pages
+SYSTEM_OBJECTS = [0x05, 0x07, 0x22, 0x29, 0x37] # sysrowsets, sysallocunits, sysschobjs, syscolpars, sysiscols
+
 class Datafile():
     def __init__(self):
         self.filepath = ''
         self.fHandle = ''
         self.fbuf = ''
         self.pagesize = 8192
+        self.fileid = 0 # from the page 0 header
+        self.mm = None
+        self.parallel = hasattr(os, 'pread')
 
     def open(self, filepath):
         try:
@@ -91,10 +148,28 @@ class Datafile():
             print('File open error : ' + filepath)
             return 1
         self.filepath = filepath
+        # pread keeps no file position and releases the GIL, so threads can read files at the same time;
+        # without it (Windows) reads go through a mapping, from one thread only
+        if not self.parallel:
+            try:
+                self.mm = mmap.mmap(self.fHandle.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, OSError):
+                self.mm = None
+        buf = self.read(0, 0x60)
+        if len(buf) == 0x60:
+            self.fileid = self.getPageHeader(buf).fileid
         print('Open ' + filepath)
 
     def read(self, offset, size):
-        buf = ''
+        if self.parallel:
+            try:
+                return os.pread(self.fHandle.fileno(), size, offset)
+            except OSError:
+                print('File read error')
+                return b''
+        if self.mm is not None:
+            return self.mm[offset:offset + size]
+        buf = b''
         try:
             self.fHandle.seek(offset)
             buf = self.fHandle.read(size)
@@ -103,6 +178,9 @@ class Datafile():
         return buf
 
     def close(self):
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
         self.fHandle.close()
 
     def getPageHeader(self, buf):
@@ -115,12 +193,196 @@ class Datafile():
         rowoffsetarray = list(filter(lambda x: x != 0, rowoffsetarray))
         return rowoffsetarray
     
+class DatafileRegistry():
+    # data files of one database keyed by file id: the primary file is 1, secondary files (.ndf) give theirs
+    # in the page 0 header. Files beyond MAX_OPEN_FILES are closed least recently used first and reopened on demand
+    def __init__(self, primary):
+        self.primary = primary
+        self.filepaths = {1: primary.filepath}
+        self.handles = OrderedDict() # fileid -> Datafile, primary excluded
+
+    def add(self, filepath):
+        df = Datafile()
+        if df.open(filepath) == 1:
+            return False
+        fileid = df.fileid
+        if fileid <= 1 or fileid in self.filepaths:
+            print('[Warning] Invalid or duplicate file id {} : {}'.format(fileid, filepath))
+            df.close()
+            return False
+        self.filepaths[fileid] = filepath
+        self._keep(fileid, df)
+        return True
+
+    def get(self, fileid):
+        if fileid == 1:
+            return self.primary
+        if fileid in self.handles:
+            self.handles.move_to_end(fileid)
+            return self.handles[fileid]
+        if fileid not in self.filepaths:
+            return None
+        df = Datafile()
+        if df.open(self.filepaths[fileid]) == 1:
+            return None
+        self._keep(fileid, df)
+        return df
+
+    def _keep(self, fileid, df):
+        df.pagesize = self.primary.pagesize
+        self.handles[fileid] = df
+        while len(self.handles) > MAX_OPEN_FILES:
+            self.handles.popitem(last=False)[1].close()
+
+    def read(self, fileid, pagenumber):
+        df = self.get(fileid)
+        if df is None:
+            return b''
+        return df.read(pagenumber * df.pagesize, df.pagesize)
+
+    def readPages(self, pages):
+        # (fileid, page number) -> page; every file is read by its own thread (pread) in ascending page order,
+        # so files on different devices are read at the same time
+        files = defaultdict(list)
+        for fileid, pagenumber in pages:
+            files[fileid].append(pagenumber)
+        fileids = sorted(files)
+
+        result = dict()
+        for i in range(0, len(fileids), MAX_OPEN_FILES):
+            handles = [(fileid, self.get(fileid)) for fileid in fileids[i:i + MAX_OPEN_FILES]]
+            def readFile(handle):
+                fileid, df = handle
+                return [((fileid, x), b'' if df is None else df.read(x * df.pagesize, df.pagesize)) for x in sorted(files[fileid])]
+            if len(handles) == 1 or not all(df is None or df.parallel for _, df in handles):
+                for handle in handles:
+                    result.update(readFile(handle))
+                continue
+            with ThreadPoolExecutor(len(handles)) as executor:
+                for pagelist in executor.map(readFile, handles):
+                    result.update(pagelist)
+        return result
+
+    def close(self):
+        for df in self.handles.values():
+            df.close()
+        self.handles.clear()
+
+class LobReader():
+    # off-row values behind row-overflow / inline root pointers and text pointers. Text pages are fetched a tree level
+    # at a time through readPages and kept in a size-bounded LRU cache, since many rows share them; a value is handed
+    # out chunk by chunk in value order
+    def __init__(self, mdf, cachesize=LOB_CACHE_SIZE):
+        self.mdf = mdf
+        self.cachesize = cachesize
+        self.cached = 0
+        self.pages = OrderedDict() # (file id, page number) -> page
+
+    def iterChunks(self, pointer):
+        if len(pointer) >= 24 and pointer[0] in (BLOB_ROW_OVERFLOW, BLOB_INLINE_ROOT):
+            # 12 bytes header, then (end offset in the value (4 bytes), page id (4 bytes), file id, slot id) entries
+            links = [unpack('<IIHH', pointer[x:x + 12]) for x in range(12, len(pointer) - 11, 12)]
+            yield from self._iterLinks(links, 0)
+        elif len(pointer) == TEXT_POINTER_SIZE:
+            yield from self._iterLinks([(0,) + unpack('<IHH', pointer[8:16])], 0)
+
+    def _iterLinks(self, links, depth):
+        if depth > MAX_LOB_DEPTH:
+            return
+        # pages of a level are fetched together, in batches that fit the cache
+        batch = max(1, min(READ_BATCH, self.cachesize // self.mdf.mssql.pagesize // 2))
+        start = 0
+        for i in range(0, len(links), batch):
+            self._fetch([(fileid, pagenumber) for _, pagenumber, fileid, _ in links[i:i + batch]])
+            for end, pagenumber, fileid, slotid in links[i:i + batch]:
+                size = end - start if end > start else None
+                start = end
+                for chunk in self._iterRecord(self._getRecord(fileid, pagenumber, slotid), depth):
+                    if size is not None:
+                        chunk = chunk[:size]
+                        size -= len(chunk)
+                    yield chunk
+                    if size == 0:
+                        break
+
+    def _iterRecord(self, record, depth):
+        # record: status (2 bytes), length, blob id (8 bytes), type (2 bytes), type dependent part
+        if record is None or len(record) < 0x0E:
+            return
+        lobtype = unpack('<H', record[0x0C:0x0E])[0]
+        # records too short for their type (a freed page reused for other data) are skipped
+        if lobtype == LOB_DATA:
+            yield record[0x0E:]
+        elif lobtype == LOB_SMALL_ROOT and len(record) >= 0x14:
+            length = unpack('<H', record[0x0E:0x10])[0]
+            yield record[0x14:0x14 + length]
+        elif lobtype == LOB_LARGE_ROOT_YUKON and len(record) >= 0x18:
+            # max links, current links, level, unused (4 bytes), then (size, row id) links of 12 bytes
+            curlinks = unpack('<H', record[0x10:0x12])[0]
+            links = [unpack('<IIHH', record[x:x + 12]) for x in range(0x18, min(0x18 + curlinks * 12, len(record) - 11), 12)]
+            yield from self._iterLinks(self._cumulative(links), depth + 1)
+        elif lobtype == LOB_INTERNAL and len(record) >= 0x14:
+            # max links, current links, level, then (offset (8 bytes), row id) links of 16 bytes
+            curlinks = unpack('<H', record[0x10:0x12])[0]
+            links = [unpack('<QIHH', record[x:x + 16]) for x in range(0x14, min(0x14 + curlinks * 16, len(record) - 15), 16)]
+            yield from self._iterLinks(links, depth + 1)
+
+    @classmethod
+    def _cumulative(self, links):
+        # link sizes -> end offsets
+        end = 0
+        result = []
+        for size, pagenumber, fileid, slotid in links:
+            end += size
+            result.append((end, pagenumber, fileid, slotid))
+        return result
+
+    def _fetch(self, pages):
+        missing = sorted(set(pages) - set(self.pages))
+        for key, (buf, _) in self.mdf.readPages(missing).items():
+            self._keep(key, buf)
+
+    def _keep(self, key, buf):
+        buf = buf or b''
+        self.pages[key] = buf
+        self.cached += len(buf)
+        while self.cached > self.cachesize and len(self.pages) > 1:
+            self.cached -= len(self.pages.popitem(last=False)[1])
+
+    def _getRecord(self, fileid, pagenumber, slotid):
+        key = (fileid, pagenumber)
+        if key not in self.pages:
+            self._fetch([key])
+        buf = self.pages.get(key, b'')
+        if key in self.pages:
+            self.pages.move_to_end(key)
+        # None for slots and records that do not fit the page
+        if len(buf) < 0x60:
+            return None
+        pageheader = self.mdf.mssql.getPageHeader(buf)
+        if slotid >= pageheader.slotcnt or 0x60 + (slotid + 1) * 2 > len(buf):
+            return None
+        offset = unpack('<H', buf[len(buf) - (slotid + 1) * 2:len(buf) - slotid * 2])[0]
+        if offset < 0x60 or offset + 4 > len(buf):
+            return None
+        length = unpack('<H', buf[offset + 2:offset + 4])[0]
+        if offset + length > len(buf):
+            return None
+        return buf[offset:offset + length]
+
 class DatafileParser():
     def __init__(self, mssql):
         self.mssql = mssql
+        self.files = DatafileRegistry(mssql)
         self.pages = defaultdict(lambda : 0) # pageMap
         self.systemschemesmap = defaultdict(list)
         self.userschemesmap = defaultdict(list)
+        self.keycolumnsmap = dict() # tobjectid -> column ids of the clustered index key
+        self.allocunits = dict() # auid -> AllocUnitInfo
+        self.gams = dict() # GAM interval -> extent bitmap
+        self.keylayouts = dict() # tobjectid -> [KeyColumn] of the clustered index key, None when it cannot be seeked
+        self.indexpages = dict() # (file id, page number) -> index page, for key seeks
+        self.rootlookupfailed = False # sysallocunits could not be read for key seeks
         self.tablelist = []
         self.of = None
 
@@ -151,6 +413,286 @@ class DatafileParser():
             
             json.dump(self.pages, open(jsonFilename, 'w'))
 
+    def scanCatalogPages(self):
+        # page map of the system catalogs from the boot page: sysallocunits, then the leaf page chain
+        # (pgfirst / nextpageid) of each base system table
+        print('MDF Catalog Page Chain Scan')
+        if self.getAllocationUnits() != True:
+            return False
+        found = set()
+        for allocunit in self.allocunits.values():
+            objectid = (allocunit.auid >> 16) & 0xffffffff
+            if allocunit.type == 1 and objectid in SYSTEM_OBJECTS and allocunit.pgfirst != 0:
+                self._mapChain(allocunit.pgfirst)
+                found.add(objectid)
+        return len(found) == len(SYSTEM_OBJECTS)
+
+    def _mapChain(self, pagenumber):
+        visited = set()
+        while pagenumber != 0 and pagenumber not in visited:
+            visited.add(pagenumber)
+            buf = self.mssql.read(pagenumber * self.mssql.pagesize, 0x60)
+            if len(buf) != 0x60:
+                break
+            pageheader = self.mssql.getPageHeader(buf)
+            if buf[0x01] == PAGE_TYPE_DATA:
+                self.pages[pagenumber] = pageheader.objectid
+            if pageheader.nextfileid != 1: # the catalog page map covers the primary file
+                break
+            pagenumber = pageheader.nextpageid
+
+    def scanAllocationPages(self):
+        # page map of the system catalogs only, from their IAM chains (no full scan, no .json)
+        print('MDF Allocation Page Scan')
+        if self.getAllocationUnits() != True:
+            return False
+        found = set()
+        for allocunit in list(self.allocunits.values()):
+            objectid = (allocunit.auid >> 16) & 0xffffffff
+            if allocunit.type == 1 and objectid in SYSTEM_OBJECTS and self._mapPages(self.getIamPages(allocunit.auid)) != 0:
+                found.add(objectid)
+        return len(found) == len(SYSTEM_OBJECTS)
+
+    def _mapPages(self, pages):
+        # only data pages, as in scanPages; number of pages mapped
+        mapped = 0
+        for pagenumber in pages:
+            buf = self.mssql.read(pagenumber * self.mssql.pagesize, 0x60)
+            if len(buf) != 0x60 or buf[0x01] != PAGE_TYPE_DATA:
+                continue
+            self.pages[pagenumber] = self.mssql.getPageHeader(buf).objectid
+            mapped += 1
+        return mapped
+
+    def readPage(self, pagenumber, fileid=1):
+        return self._restorePage(self.files.read(fileid, pagenumber))
+
+    def readPages(self, pages):
+        # {(fileid, page number): (page, page header)}, read in parallel across data files
+        return {k: self._restorePage(v) for k, v in self.files.readPages(pages).items()}
+
+    def _restorePage(self, buf):
+        if not buf or len(buf) != self.mssql.pagesize:
+            return None, None
+        pageheader = self.mssql.getPageHeader(buf)
+        if pageheader.flagbits & 0x100:
+            buf = self._tornbits(buf)
+        return buf, pageheader
+
+    def getBootPage(self):
+        # first page of sysallocunits, validated by its page header
+        buf, _ = self.readPage(BOOT_PAGE)
+        if buf is None:
+            return 0
+        for offset in FIRSTSYSINDEXES_OFFSETS:
+            pagenumber, fileid = unpack('<IH', buf[offset:offset + 6])
+            if fileid != 1 or pagenumber == 0:
+                continue
+            _, pageheader = self.readPage(pagenumber)
+            if pageheader is not None and pageheader.type == PAGE_TYPE_DATA and pageheader.objectid == 0x07:
+                return pagenumber
+        return 0
+
+    def getAllocationUnits(self):
+        # sysallocunits rows have a fixed layout, its pages are chained from the boot page
+        pagenumber = self.getBootPage()
+        if pagenumber == 0:
+            print('[Warning] sysallocunits not found from the boot page')
+            return False
+
+        visited = set()
+        while pagenumber != 0 and pagenumber not in visited:
+            visited.add(pagenumber)
+            buf, pageheader = self.readPage(pagenumber)
+            if buf is None or pageheader.objectid != 0x07:
+                break
+            for offset in self.mssql.getRowOffsetArray(buf, pageheader):
+                if buf[offset] & 0x0E != 0: # primary records only
+                    continue
+                allocunit = AllocUnitInfo()
+                allocunit.auid, allocunit.type, allocunit.ownerid, allocunit.status, allocunit.fgid = unpack('<QBQIH', buf[offset + 0x04:offset + 0x1B])
+                allocunit.pgfirst = unpack('<IH', buf[offset + 0x1B:offset + 0x21])[0]
+                allocunit.pgroot, allocunit.rootfileid = unpack('<IH', buf[offset + 0x21:offset + 0x27])
+                allocunit.pgfirstiam = unpack('<IH', buf[offset + 0x27:offset + 0x2D])[0]
+                self.allocunits[allocunit.auid] = allocunit
+            pagenumber = pageheader.nextpageid
+        return len(self.allocunits) != 0
+
+    def getIamPages(self, auid):
+        # single page allocations + extents of the IAM chain that the GAM marks allocated
+        pages = []
+        allocunit = self.allocunits.get(auid)
+        if allocunit is None:
+            return pages
+
+        visited = set()
+        pagenumber = allocunit.pgfirstiam
+        while pagenumber != 0 and pagenumber not in visited:
+            visited.add(pagenumber)
+            buf, pageheader = self.readPage(pagenumber)
+            if buf is None or pageheader.type != PAGE_TYPE_IAM:
+                break
+            startpage = unpack('<I', buf[IAM_STARTPAGE:IAM_STARTPAGE + 4])[0]
+            for i in range(8):
+                singlepage, fileid = unpack('<IH', buf[IAM_SINGLEPAGES + i * 6:IAM_SINGLEPAGES + (i + 1) * 6])
+                if singlepage != 0 and fileid == 1: # the page map covers the primary file
+                    pages.append(singlepage)
+
+            gam = self._getGamBitmap(startpage // GAM_INTERVAL)
+            for i, bits in enumerate(buf[ALLOC_BITMAP:ALLOC_BITMAP + ALLOC_BITMAP_SIZE]):
+                if bits == 0:
+                    continue
+                for bit in range(8):
+                    extent = i * 8 + bit
+                    # GAM bit set = free extent
+                    if bits >> bit & 1 and not (gam is not None and extent // 8 < len(gam) and gam[extent // 8] >> (extent % 8) & 1):
+                        pages.extend(range(startpage + extent * 8, startpage + extent * 8 + 8))
+            pagenumber = pageheader.nextpageid
+        return sorted(set(pages))
+
+    def _getGamBitmap(self, interval):
+        if interval not in self.gams:
+            buf, _ = self.readPage(interval * GAM_INTERVAL if interval != 0 else 2)
+            self.gams[interval] = None if buf is None else buf[ALLOC_BITMAP:ALLOC_BITMAP + ALLOC_BITMAP_SIZE]
+        return self.gams[interval]
+
+    def getKeyLayout(self, tobjectid, table_scheme):
+        # KeyLayout of the fixed-length key columns of the clustered index; heaps and keys with variable-length,
+        # bit or otherwise unordered columns are left to the logged slot
+        if tobjectid in self.keylayouts:
+            return self.keylayouts[tobjectid]
+        layout = None
+        keycolumns = self.keycolumnsmap.get(tobjectid)
+        if keycolumns:
+            columns = dict()
+            offset = 4 # statusBit A + statusBit B + OffsetOfTotalNumberOfCol
+            numofbitcol = 0
+            for schema in sorted(table_scheme, key=lambda SchemeInfo: SchemeInfo.colorder):
+                if schema.kindofcol != Columntype.STATIC_COLUMN:
+                    continue
+                if schema.datatype == 'bit':
+                    if numofbitcol % 8 == 0:
+                        offset += 1
+                    numofbitcol += 1
+                    continue
+                columns[schema.colorder] = KeyColumn(schema.datatype, schema.colsize, offset, schema.colorder)
+                offset += schema.colsize
+            if all(x in columns and _keyValue(columns[x].datatype, bytes(columns[x].colsize)) is not None for x in keycolumns):
+                layout = KeyLayout([columns[x] for x in keycolumns], max(x.colorder for x in table_scheme), offset)
+        self.keylayouts[tobjectid] = layout
+        return layout
+
+    def getRootPage(self, partitionid):
+        # (page number, file id) of the clustered index root (in-row data allocation unit of the partition)
+        if len(self.allocunits) == 0 and not self.rootlookupfailed and self.getAllocationUnits() != True:
+            self.rootlookupfailed = True # not retried
+        for allocunit in self.allocunits.values():
+            if allocunit.type == 1 and allocunit.ownerid == partitionid:
+                return allocunit.pgroot, allocunit.rootfileid
+        return 0, 0
+
+    @classmethod
+    def rowKey(self, buf, offset, layout):
+        # key of a data row (primary or ghost record), None when the row does not have the layout of the table
+        # or a key column is NULL
+        if offset + layout.fixedend + 2 > len(buf) or buf[offset] & 0x0E not in (0x00, 0x0A):
+            return None
+        fixedend = unpack('<H', buf[offset + 2:offset + 4])[0]
+        if fixedend != layout.fixedend or unpack('<H', buf[offset + fixedend:offset + fixedend + 2])[0] != layout.numoftotalcol:
+            return None
+        if buf[offset] & 0x10: # null bitmap
+            nullbitmap = buf[offset + fixedend + 2:offset + fixedend + 2 + math.ceil(layout.numoftotalcol / 8)]
+            for x in layout.columns:
+                if (x.colorder - 1) // 8 >= len(nullbitmap) or nullbitmap[(x.colorder - 1) // 8] >> ((x.colorder - 1) % 8) & 1:
+                    return None
+        return tuple(_keyValue(x.datatype, buf[offset + x.rowoffset:offset + x.rowoffset + x.colsize]) for x in layout.columns)
+
+    @classmethod
+    def indexKey(self, buf, offset, layout):
+        # key of an index row or of a logged row key: status byte, then the key columns in key order
+        keysize = sum(x.colsize for x in layout.columns)
+        if offset + 1 + keysize > len(buf) or (buf[offset] & 0x0E) >> 1 != 3: # index record
+            return None
+        key = []
+        offset += 1
+        for column in layout.columns:
+            key.append(_keyValue(column.datatype, buf[offset:offset + column.colsize]))
+            offset += column.colsize
+        return tuple(key)
+
+    def seekClusteredKey(self, partitionid, layout, key):
+        # (page number, page, row offset) of the data row with this key, one page read per B-tree level
+        keysize = sum(x.colsize for x in layout.columns)
+        pagenumber, fileid = self.getRootPage(partitionid)
+        for _ in range(MAX_INDEX_DEPTH):
+            if pagenumber == 0:
+                return None
+            if (fileid, pagenumber) in self.indexpages:
+                buf, pageheader = self.indexpages[(fileid, pagenumber)]
+            else:
+                buf, pageheader = self.readPage(pagenumber, fileid)
+                if buf is None:
+                    return None
+            if pageheader.slotcnt == 0:
+                return None
+            rowoffsetarray = list(reversed(unpack('<' + str(pageheader.slotcnt) + 'H', buf[-pageheader.slotcnt * 2:])))
+
+            if pageheader.type == PAGE_TYPE_INDEX:
+                if len(self.indexpages) < INDEX_CACHE:
+                    self.indexpages[(fileid, pagenumber)] = (buf, pageheader)
+                # last row whose key is <= key, the first row bounds its subtree from below
+                lo, hi = 1, len(rowoffsetarray)
+                while lo < hi:
+                    mid = (lo + hi) // 2
+                    rowkey = self.indexKey(buf, rowoffsetarray[mid], layout)
+                    if rowkey is None:
+                        return None
+                    if rowkey <= key:
+                        lo = mid + 1
+                    else:
+                        hi = mid
+                offset = rowoffsetarray[lo - 1] + 1 + keysize
+                pagenumber, fileid = unpack('<IH', buf[offset:offset + 6])
+            elif pageheader.type == PAGE_TYPE_DATA:
+                lo, hi = 0, len(rowoffsetarray)
+                while lo < hi:
+                    mid = (lo + hi) // 2
+                    rowkey = self.rowKey(buf, rowoffsetarray[mid], layout)
+                    if rowkey is None:
+                        return None
+                    if rowkey < key:
+                        lo = mid + 1
+                    else:
+                        hi = mid
+                if lo == len(rowoffsetarray) or self.rowKey(buf, rowoffsetarray[lo], layout) != key:
+                    return None
+                if buf[rowoffsetarray[lo]] & 0x0E != 0: # ghost: the row is deleted
+                    return None
+                # a non-unique key does not identify the row
+                if lo + 1 < len(rowoffsetarray) and self.rowKey(buf, rowoffsetarray[lo + 1], layout) == key:
+                    return None
+                return pagenumber, buf, rowoffsetarray[lo]
+            else:
+                return None
+        return None
+
+    def locateRow(self, partitionid, table_scheme, keybuf, slotid, page):
+        # (page, row offset) of a logged row: its slot when the row there has the logged key,
+        # a clustered index seek when the slot layout has changed since (page splits, rebuilds)
+        buf, rowoffsetarray = page
+        layout = None
+        if keybuf is not None and len(table_scheme) != 0:
+            layout = self.getKeyLayout(table_scheme[0].tobjectid, table_scheme)
+        key = None if layout is None else self.indexKey(keybuf, 0, layout)
+        if key is None or (slotid < len(rowoffsetarray) and self.rowKey(buf, rowoffsetarray[slotid], layout) == key):
+            if slotid >= len(rowoffsetarray):
+                return None
+            return buf, rowoffsetarray[slotid]
+        found = self.seekClusteredKey(partitionid, layout, key)
+        if found is None:
+            return None
+        return found[1], found[2]
+
     def getSystemTableColumnInfo(self):
         print('Get System Table Column Information')
 
@@ -309,27 +851,31 @@ class DatafileParser():
         if len(sysiscols_schemes) != rowinfo.numoftotalcol:
             return False
         
-        for tableinfo in self.tablelist:
-            tobjectid = tableinfo.tobjectid
+        # key columns of the clustered index (idminor 1), in key order
+        tobjectids = set(x.tobjectid for x in self.tablelist)
+        keycolumns = defaultdict(list)
+        for k, v in sysiscols_page.items():
+            buf = self.mssql.read(k * self.mssql.pagesize, self.mssql.pagesize)
+            pageheader = self.mssql.getPageHeader(buf)
 
-            for k, v in sysiscols_page.items():
-                buf = self.mssql.read(k * self.mssql.pagesize, self.mssql.pagesize)
-                pageheader = self.mssql.getPageHeader(buf)
+            if pageheader.flagbits & 0x100:
+                buf = self._tornbits(buf)
 
-                if pageheader.flagbits & 0x100:
-                    buf = self._tornbits(buf)
+            rowoffsetarray = sorted(self.mssql.getRowOffsetArray(buf, pageheader))
 
-                rowoffsetarray = sorted(self.mssql.getRowOffsetArray(buf, pageheader))
+            recordlen = rowoffsetarray[1:] + [self.mssql.pagesize - len(rowoffsetarray) * 2]
+            for offset, length in zip(rowoffsetarray, recordlen):
+                indexcolumn = self._parseIndexInfoRecord(buf[offset:], length - offset, sysiscols_schemes, rowinfo)
+                if indexcolumn is False:
+                    continue
+                tobjectid, indexid, indexcolumnid, columnid, keyordinal = indexcolumn
+                if tobjectid in tobjectids and indexid == 1 and keyordinal != 0:
+                    keycolumns[tobjectid].append((keyordinal, indexcolumnid, columnid))
 
-                recordlen = rowoffsetarray[1:] + [self.mssql.pagesize - len(rowoffsetarray) * 2]
-                for offset, length in zip(rowoffsetarray, recordlen):
-                    indexcolumnid = 0
-                    columnid = 0
-                    if self._parseIndexInfoRecord(buf[offset:], length - offset, sysiscols_schemes, rowinfo, tobjectid, indexcolumnid, columnid) == True:
-                        if (indexcolumnid != 0) and (columnid != 0) and (indexcolumnid != columnid):
-                            self._changeOrdinal(indexcolumnid, columnid, '', tobjectid)
+            del buf
 
-                del buf
+        for tobjectid, columns in keycolumns.items():
+            self.keycolumnsmap[tobjectid] = [columnid for _, _, columnid in sorted(columns)]
         
         return True
     
@@ -576,24 +1122,7 @@ class DatafileParser():
         else:
             return False
         
-    def _changeOrdinal(self, indexcolumnid, columnid, colname, objectid):
-        table_schemes = self.userschemesmap[objectid]
-
-        for schema in table_schemes:
-            if colname != '':
-                if schema.colname == colname:
-                    tmpOrdinal = schema.colorder
-                    schema.colorder = indexcolumnid
-            else:
-                if schema.colorder == columnid:
-                    tmpOrdinal = columnid
-                    schema.colorder = indexcolumnid
-        
-        for schema in table_schemes:
-            if (schema.colorder < tmpOrdinal) and (schema.colData > indexcolumnid):
-                schema.colorder += 1
-
-    def _parseIndexInfoRecord(self, buf, recordlen, schemlist, rowinfo, objectid, indexcolumnid, columnid):
+    def _parseIndexInfoRecord(self, buf, recordlen, schemlist, rowinfo):
         lenofnullbitmap = math.ceil(rowinfo.numoftotalcol/8)
         offsetoftotalnumofcol = unpack('<H', buf[0x02 : 0x04])[0]
         totalnumofcol = unpack('<H', buf[offsetoftotalnumofcol:offsetoftotalnumofcol + 0x02])[0]
@@ -612,6 +1141,7 @@ class DatafileParser():
         
         bitpos = 0
         numberofbitcol = 0
+        tboId = indexid = indexcolumnid = columnid = keyordinal = tbStatus = 0
 
         for schema in schemlist:
             if schema.kindofcol == Columntype.STATIC_COLUMN:
@@ -649,19 +1179,24 @@ class DatafileParser():
             # add nullbit check
             if schema.colname == 'idmajor':
                 tboId = unpack('<I', columnbuff[:4])[0]
+            elif schema.colname == 'idminor':
+                indexid = unpack('<I', columnbuff[:4])[0]
             elif schema.colname == 'status':
                 tbStatus = unpack('<I', columnbuff[:4])[0]
             elif schema.colname == 'subid':
                 indexcolumnid = unpack('<I', columnbuff[:4])[0]
             elif schema.colname == 'intprop':
                 columnid = unpack('<I', columnbuff[:4])[0]
+            elif schema.colname == 'tinyprop1':
+                keyordinal = columnbuff[0]
 
             del columnbuff
 
-        if (tboId != objectid) or ~(tbStatus & 2):
+        # status & 2: column of an index (not of statistics only), status & 0x10: included column
+        if not (tbStatus & 2) or (tbStatus & 0x10):
             return False
         else:
-            return True
+            return tboId, indexid, indexcolumnid, columnid, keyordinal
 
     def _parseObjectInfoRecord(self, buf, recordlen, schemlist, rowinfo, objectid):
         lenofnullbitmap = math.ceil(rowinfo.numoftotalcol/8)
@@ -836,4 +1371,23 @@ class DatafileParser():
         if (pid == 0) or (pid != tableinfo.partitionid) or (flag != 0x01):
             return 0
         else:
-            return allocationid
\ No newline at end of file
+            return allocationid
+
+def _keyValue(datatype, buf):
+    # sortable value of a fixed-length key column, None for types whose index order is not known here
+    # (character types follow their collation, not their bytes)
+    if datatype == 'tinyint':
+        return buf[0]
+    elif datatype == 'smallint' or datatype == 'int' or datatype == 'bigint' or datatype == 'smallmoney':
+        return int.from_bytes(buf, 'little', signed=True)
+    elif datatype == 'date':
+        return int.from_bytes(buf[:3], 'little')
+    elif datatype == 'datetime':
+        return unpack('<iI', buf[4:8] + buf[0:4])
+    elif datatype == 'smalldatetime':
+        return unpack('<HH', buf[2:4] + buf[0:2])
+    elif datatype.startswith('decimal') or datatype.startswith('numeric'):
+        return int.from_bytes(buf[1:], 'little') * (1 if buf[0] else -1)
+    elif datatype == 'binary':
+        return bytes(buf)
+    return None
@@ -0,0 +1,89 @@
+import sys
+import mmap
+
+from struct import *
+from array import array
+
+# Binary hit index written by carving and mapped back with no parsing
+#   0x00  magic (8 bytes)
+#   0x08  number of hits n (uint64)
+#   0x10  offsets, ascending (n * uint64)
+#   ....  transaction ids (n * 6 bytes)
+#   ....  op codes (n * 1 byte)
+# all integers are little-endian
+HITINDEX_MAGIC = b'MSLDFHIT'
+HITINDEX_HEADER = '<8sQ'
+TRANID_SIZE = 6
+
+class HitIndex():
+    def __init__(self):
+        self.offsets = array('Q')
+        self.tranids = bytearray()
+        self.ops = bytearray()
+        self.fHandle = None
+        self.mm = None
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def extend(self, offsets, tranids, ops):
+        self.offsets.extend(offsets)
+        self.tranids += tranids
+        self.ops += ops
+
+    def getTranid(self, i):
+        return bytes(self.tranids[i * TRANID_SIZE:(i + 1) * TRANID_SIZE])
+
+    def merge(self, results):
+        # results: (offsets, tranids, ops) per carving range, each ascending and disjoint from the others
+        for offsets, tranids, ops in sorted(filter(lambda x: len(x[0]) != 0, results), key=lambda x: x[0][0]):
+            self.extend(offsets, tranids, ops)
+
+    def write(self, filepath):
+        offsets = self.offsets
+        if sys.byteorder != 'little':
+            offsets = array('Q', offsets)
+            offsets.byteswap()
+        with open(filepath, 'wb') as f:
+            f.write(pack(HITINDEX_HEADER, HITINDEX_MAGIC, len(self.offsets)))
+            f.write(offsets.tobytes())
+            f.write(self.tranids)
+            f.write(self.ops)
+
+    def load(self, filepath):
+        try:
+            self.fHandle = open(filepath, 'rb')
+            self.mm = mmap.mmap(self.fHandle.fileno(), 0, access=mmap.ACCESS_READ)
+        except:
+            print('Hit index open error: ' + filepath)
+            return False
+
+        headersize = calcsize(HITINDEX_HEADER)
+        magic, count = unpack_from(HITINDEX_HEADER, self.mm) if len(self.mm) >= headersize else (b'', 0)
+        if magic != HITINDEX_MAGIC or len(self.mm) != headersize + count * (8 + TRANID_SIZE + 1):
+            print('Invalid hit index: ' + filepath)
+            self.close()
+            return False
+
+        view = memoryview(self.mm)
+        tranidoffset = headersize + count * 8
+        opoffset = tranidoffset + count * TRANID_SIZE
+        self.offsets = view[headersize:tranidoffset].cast('Q')
+        if sys.byteorder != 'little':
+            self.offsets = array('Q', self.offsets)
+            self.offsets.byteswap()
+        self.tranids = view[tranidoffset:opoffset]
+        self.ops = view[opoffset:]
+        print('Load {} hits from {}'.format(count, filepath))
+        return True
+
+    def close(self):
+        self.offsets = array('Q')
+        self.tranids = bytearray()
+        self.ops = bytearray()
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+        if self.fHandle is not None:
+            self.fHandle.close()
+            self.fHandle = None
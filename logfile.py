@@ -1,23 +1,37 @@
 import sys
 import os
+import errno
 import math
 import binascii
+import hashlib
+import codecs
 #import csv
 import time
 import re
+import mmap
+import signal
+import struct
 import unicodecsv as csv
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 from ctypes import *
 from struct import *
 from enum import Enum
 from datetime import datetime, timezone, timedelta
 from dataclasses import dataclass, field
-from collections import defaultdict
+from collections import defaultdict, deque
 from typing import List
 
-from multiprocessing import Process, Manager
+from array import array
+import multiprocessing
+from multiprocessing import Pool
 
 from datafile import *
+from hitindex import HitIndex
 
 @dataclass(order=True)
 class VLFInfo:
@@ -50,6 +64,7 @@ class LogRecordInfo:
     allocunitname: str = ''
     numelements: int = 0
     rowlogcontent: List[list] = field(default_factory=list)    
+    rowimages: List[bytes] = field(default_factory=list) # MODIFY_ROW: full row after / before, from RowVersions
     
 class Operation(Enum):
     LOP_UNKNOWN0 = 0
@@ -112,6 +127,9 @@ class Operation(Enum):
     LOP_TEXT_VALUE = 207
     LOP_SHINK_NOOP = 211
     
+_operations = set(x.value for x in Operation)
+_rowoperations = set([Operation.LOP_INSERT_ROWS, Operation.LOP_DELETE_ROWS, Operation.LOP_MODIFY_ROW])
+
 class Context(Enum):
     LCX_NULL = 0
     LCX_HEAP = 1
@@ -123,6 +141,179 @@ class Context(Enum):
     LCX_PFS = 11
     LCX_BOOT_PAGE_CKPT = 23
     
+class RowVersions():
+    # full row images keyed by (page id, slot id), MODIFY_ROW diffs applied in LSN order:
+    # forward from an INSERT image, backward from a DELETE image or the current MDF row
+    def __init__(self):
+        self.images = dict()
+        self.pending = defaultdict(list) # MODIFY_ROW records seen before any full image of their row
+
+    @classmethod
+    def key(self, record):
+        return (bytes(record.pageid), record.slotid)
+
+    def apply(self, record):
+        key = self.key(record)
+        if record.op == Operation.LOP_INSERT_ROWS:
+            if len(record.rowlogcontent) == 0:
+                return
+            # updates before a re-insert without a logged delete are left to the MDF fallback
+            self.pending.pop(key, None)
+            self.images[key] = bytes(record.rowlogcontent[0])
+        elif record.op == Operation.LOP_DELETE_ROWS:
+            self.images.pop(key, None)
+            if len(record.rowlogcontent) != 0:
+                self.chainBackward(self.pending.pop(key, []), bytes(record.rowlogcontent[0]))
+        elif record.op == Operation.LOP_MODIFY_ROW:
+            if len(record.rowlogcontent) < 2:
+                return
+            before = bytes(record.rowlogcontent[0])
+            after = bytes(record.rowlogcontent[1])
+            image = self.images.get(key)
+            if image is None or image[record.offsetinrow:record.offsetinrow + len(before)] != before:
+                # no image yet, or the chain misses a record: resolved backward later
+                self.images.pop(key, None)
+                self.pending[key].append(record)
+                return
+            afterimage = image[:record.offsetinrow] + after + image[record.offsetinrow + len(before):]
+            record.rowimages = [afterimage, image]
+            self.images[key] = afterimage
+
+    @classmethod
+    def chainBackward(self, records, image):
+        # image: the row right after the last of records
+        for record in reversed(records):
+            before = bytes(record.rowlogcontent[0])
+            after = bytes(record.rowlogcontent[1])
+            if image[record.offsetinrow:record.offsetinrow + len(after)] != after:
+                return
+            beforeimage = image[:record.offsetinrow] + before + image[record.offsetinrow + len(after):]
+            record.rowimages = [image, beforeimage]
+            image = beforeimage
+
+def _slotArray(buf, pageheader):
+    # page (torn bits restored) and its slot array in slot order, empty for pages that could not be read
+    if buf is None or pageheader.slotcnt == 0:
+        return buf or b'', []
+    return buf, list(reversed(unpack('<' + str(pageheader.slotcnt) + 'H', buf[-pageheader.slotcnt * 2:])))
+
+def _readDataPage(mdf, pageid, fileid=1):
+    return _slotArray(*mdf.readPage(pageid, fileid))
+
+def _pageGroups(mdf, items, pageid):
+    # (page, items on it) in ascending (file id, page id) order: each page is read once, READ_BATCH pages
+    # at a time with the data files in parallel
+    pages = defaultdict(list)
+    for item in items:
+        key = pageid(item)
+        if len(key) != 6:
+            continue
+        pagenumber, fileid = unpack('<IH', key)
+        pages[(fileid, pagenumber)].append(item)
+    keys = sorted(pages)
+    for i in range(0, len(keys), READ_BATCH):
+        bufs = mdf.readPages(keys[i:i + READ_BATCH])
+        for key in keys[i:i + READ_BATCH]:
+            yield _slotArray(*bufs[key]), pages.pop(key)
+
+def _reconstructUpdates(mdf, updates, reconstruct):
+    # id(record) -> (after image columns, before image columns) of (record, rowinfo, scheme, decode) MODIFY_ROW updates,
+    # reconstruct(record, rowinfo, scheme, decode, page) called per record with its page read once
+    results = dict()
+    for page, items in _pageGroups(mdf, [x for x in updates if len(x[0].rowlogcontent) >= 2], lambda x: x[0].pageid):
+        for record, rowinfo, table_scheme, decode in items:
+            results[id(record)] = reconstruct(record, rowinfo, table_scheme, decode, page)
+    return results
+
+def _decodeLob(parser, buf, encoding):
+    # off-row value of a CarvingProcess / LogfileParser record, decoded chunk by chunk as its pages are read through
+    # the parser's LobReader; '' / '0x' when the pointer cannot be resolved
+    if parser.lobs is None:
+        if parser.mdf is None:
+            return '0x' if encoding is None else ''
+        parser.lobs = LobReader(parser.mdf)
+    if encoding is None:
+        return '0x' + ''.join(binascii.b2a_hex(x).decode('utf8') for x in parser.lobs.iterChunks(buf))
+    decoder = codecs.getincrementaldecoder(encoding)(errors='backslashreplace') # undecodable bytes are kept visible
+    chunks = [decoder.decode(x) for x in parser.lobs.iterChunks(buf)]
+    if len(chunks) == 0:
+        return ''
+    return "'" + ''.join(chunks) + decoder.decode(b'', final=True) + "'"
+
+def _loggedKey(record):
+    # clustered index key logged with a row change, None for heaps
+    if record.context == Context.LCX_CLUSTERED.value and len(record.rowlogcontent) > 2:
+        return bytes(record.rowlogcontent[2])
+    return None
+
+class StatementTemplate():
+    # INSERT / DELETE / UPDATE skeletons of a table built once, a row is rendered with a single format call
+    def __init__(self, tablename, table_scheme, keycolumns=None, columns=None, keyonly=False):
+        names = [self.quoteName(x.colname) for x in table_scheme]
+        numofcol = len(names)
+        colorders = [x.colorder for x in table_scheme]
+        keyindex = None
+        if keycolumns and all(x in colorders for x in keycolumns):
+            keyindex = [colorders.index(x) for x in keycolumns]
+
+        # projection: the requested columns plus the key columns, the others are not decoded
+        selected = list(range(numofcol))
+        projected = selected
+        self.decode = None
+        if columns:
+            missing = set(columns) - set(x.colname for x in table_scheme)
+            if len(missing) != 0:
+                print('[Warning] Unknown columns of {}: {}'.format(tablename, ', '.join(sorted(missing))))
+            if len(missing) == len(set(columns)):
+                print('[Warning] No requested column in {}, all columns are written'.format(tablename))
+            else:
+                selected = [i for i, x in enumerate(table_scheme) if x.colname in columns]
+                projected = [i for i in range(numofcol) if i in selected or (keyindex is not None and i in keyindex)]
+                self.decode = [i in projected for i in range(numofcol)]
+
+        # WHERE on the key columns only when every key column is in the scheme
+        where = keyindex if keyonly and keyindex is not None else projected
+
+        table = self.quoteName(tablename)
+        self.numofcol = numofcol
+        if self.decode is None:
+            self.insert = 'insert into ' + table + ' values (' + ','.join('{' + str(i) + '}' for i in projected) + ')'
+        else:
+            self.insert = 'insert into ' + table + ' (' + ','.join(names[i] for i in projected) + ') values (' + \
+                ','.join('{' + str(i) + '}' for i in projected) + ')'
+        self.delete = 'delete from ' + table + ' where ' + ' and '.join(names[i] + '={' + str(i) + '}' for i in where)
+        # update arguments: after image columns, then before image columns; key columns added for the WHERE are not set
+        self.assign = [names[i] + '={' + str(i) + '}' for i in range(numofcol)]
+        self.setcolumns = selected
+        self.updatehead = 'update ' + table + ' set '
+        self.updatewhere = ' where ' + ' and '.join(names[i] + '={' + str(numofcol + i) + '}' for i in where)
+        self.update = self.updatehead + ', '.join(self.assign[i] for i in selected) + self.updatewhere
+        self.changedonly = keyonly and keyindex is not None # the row is found by its key, only changed columns are set
+
+    @classmethod
+    def quoteName(self, name):
+        # bracket-quoted identifier, braces doubled for str.format
+        return ('[' + name.replace(']', ']]') + ']').replace('{', '{{').replace('}', '}}')
+
+    # False when the row was cut short while decoding
+    def renderInsert(self, coldata):
+        if self.numofcol == 0 or len(coldata) != self.numofcol:
+            return False
+        return self.insert.format(*coldata)
+
+    def renderDelete(self, coldata):
+        if self.numofcol == 0 or len(coldata) != self.numofcol:
+            return False
+        return self.delete.format(*coldata)
+
+    def renderUpdate(self, after, before):
+        if self.numofcol == 0 or len(after) != self.numofcol or len(before) != self.numofcol:
+            return False
+        if self.changedonly:
+            changed = [i for i in self.setcolumns if after[i] != before[i]] or self.setcolumns
+            return (self.updatehead + ', '.join(self.assign[i] for i in changed) + self.updatewhere).format(*after, *before)
+        return self.update.format(*after, *before)
+
 class Logfile():
     def __init__(self):
         self.filepath = ''
@@ -154,17 +345,23 @@ class Logfile():
         self.fHandle.close()
         
 class CarvingProcess():
-    def __init__(self, filepath, chunksize):
+    def __init__(self, filepath, chunksize, windowsize=None, numofprocess=None):
         super().__init__()
         
         self.fHandle = ''
         self.filepath = filepath
         self.chunksize = chunksize
+        self.windowsize = windowsize if windowsize else CARVING_WINDOW
+        self.numofprocess = numofprocess # None = derived from CPU count and storage type
+        self.skipped = 0
+        self.duplicates = 0
+        self.cancelled = False
         self.records = list()
         self.transactions = defaultdict(list)
         self.queries = []
-        self.manager = Manager()
         self.rawdata = list()
+        self.mdf = None
+        self.lobs = None # LobReader of the MDF given to recovery
         
     def open(self):
         try:
@@ -194,76 +391,229 @@ class CarvingProcess():
                 wr.writerow(header)
                 wr.writerows(self.queries)
     
-    def process(self, offsetfile=None):
+    def process(self, hitfile=None, pool=None, partitionids=None):
         start_time = int(time.time())
+
+        fsize = os.path.getsize(self.filepath)
+
+        hits = HitIndex()
+        try:
+            # an existing hit index (from an earlier run) is mapped instead of carving again
+            if hitfile is None or not os.path.isfile(hitfile) or hits.load(hitfile) != True:
+                # each worker returns its hits in bulk: offsets (uint64), 6-byte transaction ids and op codes
+                self.skipped = 0
+                results = self._runTasks(carving, pool)
+                hits.merge(self._collectResults(results))
+                del results
+                print('Skip {} bytes of holes and constant-fill clusters ({:.1f}%)'.format(self.skipped, self.skipped * 100 / fsize if fsize else 0))
+
+                if hitfile is not None and not self.cancelled: # a partial index would be reused as complete
+                    hits.write(hitfile)
+
+            end_time = int(time.time())
+            print("***run time(sec): ", end_time-start_time)
+
+            self._extractRecords(hits, partitionids)
+        except KeyboardInterrupt:
+            self._cancelStep()
+        finally:
+            hits.close()
+        self.dedup()
         
-        object_list = []
+        print('Complete')
+
+    def processBlocks(self, pool=None):
+        start_time = int(time.time())
+
+        # whole log blocks (segment header + slot array) found in the image, parsed with LogfileParser.parseSegment
+        blockOffset = array('Q')
+        blockLength = array('I')
+        self.skipped = 0
+        try:
+            for offsets, lengths, skipped in sorted(self._runTasks(carvingBlocks, pool), key=lambda x: x[0][0] if len(x[0]) else 0):
+                blockOffset.extend(offsets)
+                blockLength.extend(lengths)
+                self.skipped += skipped
+
+            end_time = int(time.time())
+            print("***run time(sec): ", end_time-start_time)
+            print('Found {} log blocks'.format(len(blockOffset)))
+
+            print('Skip {} bytes of holes'.format(self.skipped))
+
+            self._parseBlocks(blockOffset, blockLength)
+        except KeyboardInterrupt:
+            self._cancelStep()
+        self.dedup()
+
+        print('Complete')
+
+    def _cancelStep(self):
+        # Ctrl-C after carving (merge, validation, parsing): the records parsed so far are kept
+        self.cancelled = True
+        print('[Cancel] Stopped by user, keep {} log records'.format(len(self.records)))
+
+    def dedup(self):
+        # the same record carved from several copies of a block: keep the best-validated copy
+        best = dict()
+        for recordinfo in self.records:
+            key = self._dedupKey(recordinfo)
+            if key not in best or self._recordScore(recordinfo) > self._recordScore(best[key]):
+                best[key] = recordinfo
+
+        self.duplicates = len(self.records) - len(best)
+        if self.duplicates == 0:
+            return
+        print('Remove {} duplicate log records'.format(self.duplicates))
+
+        self.records = sorted(best.values(), key=lambda x: x.offset)
+        self.transactions = defaultdict(list)
+        for recordinfo in self.records:
+            self.transactions[recordinfo.transactionid].append(recordinfo)
+
+    @classmethod
+    def _dedupKey(self, recordinfo):
+        digest = hashlib.blake2b(digest_size=16)
+        for content in recordinfo.rowlogcontent:
+            digest.update(pack('<I', len(content)))
+            digest.update(content)
+        return (bytes(recordinfo.transactionid), tuple(recordinfo.previousLSN), recordinfo.op, digest.digest())
+
+    @classmethod
+    def _recordScore(self, recordinfo):
+        # parsed from an intact log block > complete row log contents > transaction time decoded > lower offset
+        return (recordinfo.slotnum != 0,
+                sum(1 for x in recordinfo.rowlogcontent if len(x) != 0),
+                recordinfo.begintime != '' or recordinfo.endtime != '',
+                -recordinfo.offset)
+
+    def _runTasks(self, func, pool=None):
         fsize = os.path.getsize(self.filepath)
         secsize = 512
         clustersize = secsize * 8
         numofcluster = fsize // clustersize
-        numofprocess = 10
-        unit = numofcluster // numofprocess
-        
-        threshold = 500000
-        
-        if offsetfile is None:
-            hitOffset = self.manager.dict()
-            for i in range(0 ,numofprocess):
-                if i == (numofprocess - 1):
-                    task = Process(target=carving, args=(self.filepath, i * unit, numofcluster + 1, self.chunksize, hitOffset))
-                else:
-                    task = Process(target=carving, args=(self.filepath, i * unit, (i + 1) * unit, self.chunksize, hitOffset))
-                object_list.append(task)
-                task.start()
-            
-            for task in object_list:
-                task.join()
+        numofprocess = self.numofprocess if self.numofprocess else carvingWorkers(self.filepath)
+        unit = max(1, CARVING_UNIT // self.chunksize)
+
+        # small ranges are queued to the pool one at a time, a worker that finishes early takes the next one
+        tasks = []
+        for start in range(0, numofcluster + 1, unit):
+            tasks.append((func, self.filepath, start, min(start + unit, numofcluster + 1), self.chunksize, self.windowsize))
+
+        self.cancelled = False
+        progress = CarvingProgress(fsize)
+        ownpool = pool is None
+        if ownpool:
+            print('Carving with {} processes'.format(numofprocess))
+            pool = carvingPool(numofprocess)
+        # bytes scanned by the workers, counted per window, and the flag that stops them
+        scanned = getattr(pool, 'scanned', None)
+        cancel = getattr(pool, 'cancel', None)
+        if scanned is not None:
+            scanned.value = 0
+            cancel.value = 0
+        results = []
+        try:
+            it = pool.imap_unordered(_carvingTask, tasks)
+            while True:
+                try:
+                    pid, start, elapsed, result = it.next(PROGRESS_INTERVAL)
+                except multiprocessing.TimeoutError:
+                    progress.tick(scanned.value if scanned is not None else None)
+                    continue
+                except StopIteration:
+                    break
+                nbytes = min((start + unit) * self.chunksize, fsize) - start * self.chunksize
+                progress.update(pid, nbytes, len(result[0]), elapsed, scanned.value if scanned is not None else None)
+                results.append(result)
+        except KeyboardInterrupt:
+            # ranges already returned are kept, the rest of the image is not carved
+            self.cancelled = True
+            print('[Cancel] Carving stopped by user, keep {} hits from {:.2f} GB'.format(progress.hits, progress.done / (1 << 30)))
+            if cancel is not None:
+                cancel.value = 1 # workers of a shared pool drop the rest of their ranges
+            if ownpool:
+                pool.terminate()
+        finally:
+            if ownpool:
+                pool.close()
+                pool.join()
+        progress.printWorkers()
+        return results
+
+    def _collectResults(self, results):
+        for offsets, tranids, ops, skipped in results:
+            self.skipped += skipped
+            yield offsets, tranids, ops
+
+    def _parseBlocks(self, blockOffset, blockLength):
+        parser = LogfileParser(Logfile())
+        failed = 0
+        for offset, length in zip(blockOffset, blockLength):
+            buf = self.read(offset, length)
+            firstLsn = unpack('<iih', buf[0x0C:0x16])
+            vlfinfo = VLFInfo()
+            vlfinfo.seqnum = firstLsn[0]
+            numofrecord = len(parser.records)
+            try:
+                parser.parseSegment(buf, vlfinfo, firstLsn[1])
+            except (struct.error, IndexError, ValueError):
+                del parser.records[numofrecord:]
+                failed += 1
+                continue
+            for recordinfo in parser.records[numofrecord:]:
+                recordinfo.offset += offset # offset in the image
+                self.records.append(recordinfo)
+                self.transactions[recordinfo.transactionid].append(recordinfo)
+        if failed != 0:
+            print('[Warning] {} log blocks could not be parsed'.format(failed))
+
+    def _extractRecords(self, hits, partitionids=None):
+        # hits are in offset order, so extraction is one forward sweep over a mapping of the image
+        try:
+            mm = mmap.mmap(self.fHandle.fileno(), 0, access=mmap.ACCESS_READ)
+            if hasattr(mm, 'madvise'):
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+            read = lambda offset, size: mm[offset:offset + size]
+        except (ValueError, OSError):
+            mm = None
+            read = self.read
+
+        # cheap header checks on all candidates first, only plausible ones are parsed
+        if mm is not None:
+            keep = validateHits(mm, hits.offsets, hits.ops, partitionids)
         else:
-            hitOffset = defaultdict(int)
-            with open(offsetfile, 'r') as f:
-                data = f.read()
-                iter = re.finditer("\d+: b\\\\?[\'\"]", data)
-                start = []
-                for matched in iter:
-                    start.append(matched.start())
-                    #if len(start) == threshold:
-                    #    break
-                    
-                end = start[1:] + [len(data) + 1]
-                #end = start[1:threshold + 1]
-                
-                for start, end in zip(start, end):
-                    line = data[start:end-2]
-                    offset = line[:re.match("\d+: b", line).end() - 3]
-                    tranid = line[re.match("\d+: b", line).end() - 1:]
-                    hitOffset[eval(offset)] = eval(tranid)
-                    #if len(hitOffset) == threshold:
-                    #    break
-                
-            
-        end_time = int(time.time())
-        print("***run time(sec): ", end_time-start_time)
-        
-        for offset, tranid in hitOffset.items():
-            buf = self.read(offset, self.chunksize)
+            # no mapping: scalar checks on a read of the longest possible record
+            keep = [_validateHit(read(offset, MAX_LOGRECORD), 0, op, partitionids) for offset, op in zip(hits.offsets, hits.ops)]
+        print('Reject {} of {} carving candidates'.format(len(keep) - sum(keep), len(keep)))
+
+        for i, offset in enumerate(hits.offsets):
+            if not keep[i]:
+                continue
+            tranid = hits.getTranid(i)
+            buf = read(offset, self.chunksize)
             recordlen = self._calcLogRecordLen(buf)
-            del buf
             
-            recordbuf = self.read(offset, recordlen)
+            if recordlen <= len(buf):
+                recordbuf = buf[:recordlen]
+            else:
+                recordbuf = read(offset, recordlen)
+            del buf
             recordinfo = self._parseRecord(recordbuf)
             if recordinfo is None:
                 continue
             recordinfo.offset = offset
             self.records.append(recordinfo)
             self.transactions[tranid].append(recordinfo)
+
+        if mm is not None:
+            mm.close()
         
-        print('Complete')
-        
-    def recovery(self, mdf):
+    def recovery(self, mdf, sink=None, keyonly=False, columns=None):
         print('Reconstruct Log Record')
         if mdf is None:
             print('[Error] Need insert matched data file')
+        self.mdf = mdf
             
         for tableinfo in mdf.tablelist:
             
@@ -279,59 +629,66 @@ class CarvingProcess():
 
             for schema in table_scheme:
                 mdf._tableSchemeAnalyzer(schema, rowinfo)
+            template = StatementTemplate(tableinfo.tablename, table_scheme, mdf.keycolumnsmap.get(tableinfo.tobjectid), columns.get(tableinfo.tablename) if columns else None, keyonly)
             
             #queries = []
             # log record in tableinfo
             records = [x for x in self.records if x.partitionid == tableinfo.partitionid]
-            
-            for record in records:
-                record.allocunitname = tableinfo.tablename
-                if record.op == Operation.LOP_INSERT_ROWS:
-                    if len(record.rowlogcontent) > 0:
-                        query = self._reconstructInsertDeleteRow(record.rowlogcontent[0], rowinfo, table_scheme, mdf.mssql.pagesize)
+            # chunks of RECOVERY_CHUNK records: the pages of a chunk's updates are read together, its results dropped once written
+            reconstruct = lambda x, info, scheme, decode, page: self._reconstructUpdateRow(x, info, scheme, mdf, decode, page)
+            for start in range(0, len(records), RECOVERY_CHUNK):
+                chunk = records[start:start + RECOVERY_CHUNK]
+                updates = _reconstructUpdates(mdf, [(x, rowinfo, table_scheme, template.decode) for x in chunk if x.op == Operation.LOP_MODIFY_ROW], reconstruct)
+                for record in chunk:
+                    record.allocunitname = tableinfo.tablename
+                    if record.op == Operation.LOP_INSERT_ROWS:
+                        if len(record.rowlogcontent) > 0:
+                            query = self._reconstructInsertDeleteRow(record.rowlogcontent[0], rowinfo, table_scheme, mdf.mssql.pagesize, template.decode)
+                        else:
+                            query = False
+                        if query is not False:
+                            query = template.renderInsert(query)
+                    elif record.op == Operation.LOP_DELETE_ROWS:
+                        if len(record.rowlogcontent) > 0:
+                            query = self._reconstructInsertDeleteRow(record.rowlogcontent[0], rowinfo, table_scheme, mdf.mssql.pagesize, template.decode)
+                        else:
+                            query = False
+                        if query is not False:
+                            query = template.renderDelete(query)
+                    elif record.op == Operation.LOP_MODIFY_ROW:
+                        if id(record) in updates:
+                            query = updates[id(record)]
+                        else:
+                            query = self._reconstructUpdateRow(record, rowinfo, table_scheme, mdf, template.decode)
+                        if query[0] and query[1]:
+                            query = template.renderUpdate(query[0], query[1])
+                        else:
+                            query = False
+                    transaction = self.transactions[record.transactionid]
+                    beginxact = [x for x in transaction if x.op == Operation.LOP_BEGIN_XACT]
+                    if len(beginxact) != 0:
+                        begintime = beginxact[0].begintime
                     else:
-                        query = False
-                    if query is not False:
-                        query = ','.join(query)
-                        query = "insert into " + tableinfo.tablename + " values (" + query + ")"
-                elif record.op == Operation.LOP_DELETE_ROWS:
-                    if len(record.rowlogcontent) > 0:
-                        query = self._reconstructInsertDeleteRow(record.rowlogcontent[0], rowinfo, table_scheme, mdf.mssql.pagesize)
+                        begintime = ''
+                    commitxact = [x for x in transaction if x.op == Operation.LOP_COMMIT_XACT]
+                    if len(commitxact) != 0:
+                        endtime = commitxact[0].endtime
                     else:
-                        query = False
-                    condition_str = []
-                    if query is not False:
-                        for i, schema in enumerate(table_scheme):
-                            condition_str.append(schema.colname + "=" + query[i])
-                        query = "delete from " + tableinfo.tablename + " where " + ' and '.join(condition_str)
-                elif record.op == Operation.LOP_MODIFY_ROW:
-                    query = self._reconstructUpdateRow(record, rowinfo, table_scheme, mdf)
-                    set_str = []
-                    condition_str = []
-                    if query[0] and query[1]:
-                        for i, schema in enumerate(table_scheme):
-                            set_str.append(schema.colname + "=" + query[0][i])
-                            condition_str.append(schema.colname + "=" + query[1][i])
-                        query = "update " + tableinfo.tablename + " set " + ', '.join(set_str) + " where " + ' and '.join(condition_str)                            
+                        endtime = ''
+                    if sink is not None:
+                        # streamed out as produced, nothing is kept in memory
+                        if query is not False:
+                            written = sink.writeStatement(begintime, endtime, record, tableinfo.tablename, query)
+                        else:
+                            written = sink.writeRaw(begintime, endtime, record, tableinfo.tablename)
+                        if written is False:
+                            return
+                    elif query is not False:
+                        self.queries.append([begintime, endtime, record.op, query])
                     else:
-                        query = False
-                transaction = self.transactions[record.transactionid]
-                beginxact = [x for x in transaction if x.op == Operation.LOP_BEGIN_XACT]
-                if len(beginxact) != 0:
-                    begintime = beginxact[0].begintime
-                else:
-                    begintime = ''
-                commitxact = [x for x in transaction if x.op == Operation.LOP_COMMIT_XACT]
-                if len(commitxact) != 0:
-                    endtime = commitxact[0].endtime
-                else:
-                    endtime = ''
-                if query is not False:
-                    self.queries.append([begintime, endtime, record.op, query])
-                else:
-                    self.rawdata.append([begintime, endtime, record.op, record])
+                        self.rawdata.append([begintime, endtime, record.op, record])
             
-    def _reconstructInsertDeleteRow(self, buf, rowinfo, schemlist, pagesize):
+    def _reconstructInsertDeleteRow(self, buf, rowinfo, schemlist, pagesize, decode=None):
         recordlen = len(buf)
         if recordlen < 4:
             return False
@@ -360,7 +717,7 @@ class CarvingProcess():
         coldata = []
         isLob = False
         
-        for schema in schemlist:
+        for colindex, schema in enumerate(schemlist):
             if schema.kindofcol == Columntype.STATIC_COLUMN:
                 columnlength = schema.colsize
                 if schema.datatype == 'bit':
@@ -394,36 +751,37 @@ class CarvingProcess():
                         columnbuff = buf[variableoffset:variableoffset + columnlength]
                         variableoffset += columnlength
                         
+            # offsets above are advanced for every column, only projected columns are decoded
+            if decode is not None and not decode[colindex]:
+                coldata.append(None)
+                isLob = False
+                continue
             output = self._decodeValue(columnbuff, columnlength, schema, numberofbitcol, isLob)
             coldata.append(output)
             isLob = False
         
         return coldata
     
-    def _reconstructUpdateRow(self, record, rowinfo, schemlist, mdf):
+    def _reconstructUpdateRow(self, record, rowinfo, schemlist, mdf, decode=None, page=None):
         if len(record.rowlogcontent) > 1:
             before = record.rowlogcontent[0]
             after = record.rowlogcontent[1]
         else:
             return False, False
-        pageid, _ = unpack('<IH', record.pageid) # limitation fileid = 1
-        buf = mdf.mssql.read(pageid * mdf.mssql.pagesize, mdf.mssql.pagesize)
-        pageheader = mdf.mssql.getPageHeader(buf)
-        
-        if pageheader.flagbits & 0x100:
-            buf = mdf._tornbits(buf)
-            
-        fmt = '<' + str(pageheader.slotcnt) + 'H'
-        rowoffsetarray = list(reversed(unpack(fmt, buf[-pageheader.slotcnt * 2:])))
-        if record.slotid >= len(rowoffsetarray):
+        if page is None:
+            pageid, fileid = unpack('<IH', record.pageid)
+            page = _readDataPage(mdf, pageid, fileid)
+        row = mdf.locateRow(record.partitionid, schemlist, _loggedKey(record), record.slotid, page)
+        if row is None:
             return False, False
-        recordlen = self._calcDataRecordLen(buf[rowoffsetarray[record.slotid]:], rowinfo)
-        recordbuf = buf[rowoffsetarray[record.slotid]:rowoffsetarray[record.slotid] + recordlen]
+        buf, offset = row
+        recordlen = self._calcDataRecordLen(buf[offset:], rowinfo)
+        recordbuf = buf[offset:offset + recordlen]
         
-        after_coldata = self._reconstructInsertDeleteRow(recordbuf, rowinfo, schemlist, mdf.mssql.pagesize)
+        after_coldata = self._reconstructInsertDeleteRow(recordbuf, rowinfo, schemlist, mdf.mssql.pagesize, decode)
         before_recordbuf = recordbuf[:record.offsetinrow] + recordbuf[record.offsetinrow:record.offsetinrow+len(after)].replace(after, before) + \
             recordbuf[record.offsetinrow+len(after):]
-        before_coldata = self._reconstructInsertDeleteRow(before_recordbuf, rowinfo, schemlist, mdf.mssql.pagesize)
+        before_coldata = self._reconstructInsertDeleteRow(before_recordbuf, rowinfo, schemlist, mdf.mssql.pagesize, decode)
         
         if after_coldata is False or before_coldata is False:
             return False, False
@@ -517,7 +875,6 @@ class CarvingProcess():
             ## rowlogcontent 0~5            
         return recordinfo
     
-    @classmethod
     def _decodeValue(self, buf, length, schema, numberofbitcol, isLob):
         output = ''
         if schema.datatype == "tinyint":
@@ -545,24 +902,21 @@ class CarvingProcess():
             output = "'" + buf.decode('utf8') + "'"
         elif schema.datatype == "varchar":
             if isLob: # Large object
-                output = ""
-                #output = "'" + self._parseLobRecord(buf).decode('utf8') + "'"
+                output = _decodeLob(self, buf, 'utf8')
             else:
                 output = "'" + buf.decode('utf8', errors="ignore") + "'"
         elif schema.datatype == "nchar":
             output = "'" + buf.decode('utf16') + "'" # xml, text, ntext, image
         elif schema.datatype == "nvarchar":
             if isLob: # Large object
-                output = ""
-                #output = "'" + self._parseLobRecord(buf).decode('utf16') + "'"
+                output = _decodeLob(self, buf, 'utf-16-le')
             else:
                 output = "'" + buf.decode('utf16') + "'" # hierarchyid, geometry, geography, uniqueidentifier, sql_variant
         elif schema.datatype == "binary":
             output = '0x' + (binascii.b2a_hex(buf)).decode('utf8')
         elif schema.datatype == "varbinary":
             if isLob: # 8bytes => lob header (type(2 byptes) / level(1 byte) / unused(1 byte) / updateseq(4 bytes))              
-                output = '0x'
-                #output = '0x' + (binascii.b2a_hex(self._parseLobRecord(buf))).decode('utf8')
+                output = _decodeLob(self, buf, None)
             else:
                 output = '0x' + (binascii.b2a_hex(buf)).decode('utf8')
         # text, ntext, image
@@ -578,7 +932,9 @@ class LogfileParser():
         self.records = list()
         self.segments = defaultdict(int)
         self.transactions = defaultdict(list)
+        self.rowhistory = defaultdict(list) # (partitionid, pageid, slotid) -> log records that touched the row
         self.queries = []
+        self.lobs = None # LobReader of mdf, created on the first off-row value
         
     def scanVLFs(self):
         print('LDF VLF(Virtual Log Files) Scan')
@@ -663,6 +1019,8 @@ class LogfileParser():
             recordinfo.offset = offset
             self.records.append(recordinfo)
             self.transactions[recordinfo.transactionid].append(recordinfo)
+            if recordinfo.op in _rowoperations:
+                self.rowhistory[(recordinfo.partitionid, bytes(recordinfo.pageid), recordinfo.slotid)].append(recordinfo)
 
     @classmethod  
     def _fixup(self, buf, blksize):
@@ -674,62 +1032,170 @@ class LogfileParser():
             
         return bytes(origin)
     
-    def recovery(self):
+    def recovery(self, sink=None, numofprocess=None, keyonly=False, columns=None, pool=None):
+        # statements table by table, in log order within a table, whether reconstructed serially or by workers
         print('Reconstruct Log Record')
         if self.mdf is None:
             print('[Error] Need insert matched data file')
 
-        for tableinfo in self.mdf.tablelist:
-            table_scheme = self.mdf.userschemesmap[tableinfo.tobjectid]
-            table_scheme = sorted(table_scheme, key=lambda SchemeInfo: SchemeInfo.colorder)
-            
-            rowinfo = RowInfo()
+        tables = self._recoveryTables(keyonly, columns)
+        for _, table_scheme, rowinfo, records, _ in tables:
+            self._chainRowVersions(records, rowinfo, table_scheme)
 
-            if len(table_scheme) == 0:
-                continue
+        if numofprocess is not None and numofprocess > 1:
+            results = self._recoveryParallel(tables, numofprocess, pool)
+        else:
+            results = self._recoverySerial(tables)
 
-            for schema in table_scheme:
-                self.mdf._tableSchemeAnalyzer(schema, rowinfo)
-            
-            #queries = []
-            # log record in tableinfo
-            records = [x for x in self.records if x.partitionid == tableinfo.partitionid]
-            
-            for record in records:
-                if record.op == Operation.LOP_INSERT_ROWS:
-                    query = self._reconstructInsertDeleteRow(record.rowlogcontent[0], rowinfo, table_scheme)
-                    if query is not False:
-                        query = ','.join(query)
-                        query = "insert into " + tableinfo.tablename + " values (" + query + ")"
-                elif record.op == Operation.LOP_DELETE_ROWS:
-                    query = self._reconstructInsertDeleteRow(record.rowlogcontent[0], rowinfo, table_scheme)
-                    condition_str = []
+        try:
+            for record, tablename, query in results:
+                begintime, endtime = self._transactionTime(record)
+                if sink is not None:
                     if query is not False:
-                        for i, schema in enumerate(table_scheme):
-                            condition_str.append(schema.colname + "=" + query[i])
-                        query = "delete from " + tableinfo.tablename + " where " + ' and '.join(condition_str)
-                elif record.op == Operation.LOP_MODIFY_ROW:
-                    query = self._reconstructUpdateRow(record, rowinfo, table_scheme)
-                    set_str = []
-                    condition_str = []
-                    if query[0] and query[1]:
-                        for i, schema in enumerate(table_scheme):
-                            set_str.append(schema.colname + "=" + query[0][i])
-                            condition_str.append(schema.colname + "=" + query[1][i])
-                        query = "update " + tableinfo.tablename + " set " + ', '.join(set_str) + " where " + ' and '.join(condition_str)                            
-                transaction = self.transactions[record.transactionid]
-                beginxact = [x for x in transaction if x.op == Operation.LOP_BEGIN_XACT]
-                if len(beginxact) != 0:
-                    begintime = beginxact[0].begintime
-                else:
-                    begintime = ''
-                commitxact = [x for x in transaction if x.op == Operation.LOP_COMMIT_XACT]
-                if len(commitxact) != 0:
-                    endtime = commitxact[0].endtime
-                else:
-                    endtime = ''
-                if query is not False:
+                        written = sink.writeStatement(begintime, endtime, record, tablename, query)
+                    else:
+                        written = sink.writeRaw(begintime, endtime, record, tablename)
+                    if written is False:
+                        return
+                elif query is not False:
                     self.queries.append([begintime, endtime, str(record.op), query])
+        finally:
+            results.close()
+
+    def _transactionTime(self, record):
+        transaction = self.transactions[record.transactionid]
+        beginxact = [x for x in transaction if x.op == Operation.LOP_BEGIN_XACT]
+        if len(beginxact) != 0:
+            begintime = beginxact[0].begintime
+        else:
+            begintime = ''
+        commitxact = [x for x in transaction if x.op == Operation.LOP_COMMIT_XACT]
+        if len(commitxact) != 0:
+            endtime = commitxact[0].endtime
+        else:
+            endtime = ''
+        return begintime, endtime
+
+    def rowHistory(self, partitionid, pageid, slotid, fileid=1):
+        # every version of one row: [LSN, op, begin time, end time, columns after the record (before it for DELETE)]
+        records = self.rowhistory.get((partitionid, pack('<IH', pageid, fileid), slotid), [])
+        if len(records) == 0 or self.mdf is None:
+            return []
+        tableinfo = [x for x in self.mdf.tablelist if x.partitionid == partitionid]
+        if len(tableinfo) == 0:
+            return []
+        table_scheme, rowinfo = self._analyzeTable(tableinfo[0])
+
+        records = sorted(records, key=lambda x: (x.vlfseqnum, x.blocknum, x.slotnum))
+        self._chainRowVersions(records, rowinfo, table_scheme)
+
+        history = []
+        for record in records:
+            if record.op == Operation.LOP_MODIFY_ROW:
+                image = record.rowimages[0] if len(record.rowimages) == 2 else None
+            else:
+                image = record.rowlogcontent[0] if len(record.rowlogcontent) != 0 else None
+            coldata = False
+            if image is not None:
+                coldata = self._reconstructInsertDeleteRow(image, rowinfo, table_scheme)
+            begintime, endtime = self._transactionTime(record)
+            history.append([(record.vlfseqnum, record.blocknum, record.slotnum), record.op, begintime, endtime, coldata])
+        return history
+
+    def _analyzeTable(self, tableinfo):
+        table_scheme = self.mdf.userschemesmap[tableinfo.tobjectid]
+        table_scheme = sorted(table_scheme, key=lambda SchemeInfo: SchemeInfo.colorder)
+
+        rowinfo = RowInfo()
+        for schema in table_scheme:
+            self.mdf._tableSchemeAnalyzer(schema, rowinfo)
+        return table_scheme, rowinfo
+
+    def _recoveryTables(self, keyonly=False, columns=None):
+        # (tableinfo, analyzed scheme, rowinfo, log records of the table, statement template) for every user table
+        partitions = defaultdict(list)
+        for record in self.records:
+            partitions[record.partitionid].append(record)
+
+        tables = []
+        for tableinfo in self.mdf.tablelist:
+            table_scheme, rowinfo = self._analyzeTable(tableinfo)
+            if len(table_scheme) == 0:
+                continue
+
+            template = StatementTemplate(tableinfo.tablename, table_scheme, self.mdf.keycolumnsmap.get(tableinfo.tobjectid), columns.get(tableinfo.tablename) if columns else None, keyonly)
+            records = sorted(partitions.get(tableinfo.partitionid, []), key=lambda x: (x.vlfseqnum, x.blocknum, x.slotnum))
+            tables.append((tableinfo, table_scheme, rowinfo, records, template))
+        return tables
+
+    def _recoverySerial(self, tables):
+        # chunks of RECOVERY_CHUNK records: the pages of a chunk's updates are read together, its results dropped once emitted
+        for tableinfo, table_scheme, rowinfo, records, template in tables:
+            for start in range(0, len(records), RECOVERY_CHUNK):
+                chunk = records[start:start + RECOVERY_CHUNK]
+                yield from zip(chunk, [tableinfo.tablename] * len(chunk), self._recoverChunk(chunk, template, rowinfo, table_scheme))
+
+    def _recoverChunk(self, records, template, rowinfo, table_scheme):
+        updates = _reconstructUpdates(self.mdf, [(record, rowinfo, table_scheme, template.decode) for record in records
+            if record.op == Operation.LOP_MODIFY_ROW and len(record.rowimages) == 0], self._reconstructUpdateRow)
+        return [self._reconstructRecord(record, template, rowinfo, table_scheme, updates) for record in records]
+
+    def _recoveryParallel(self, tables, numofprocess, pool=None):
+        # chunks of RECOVERY_CHUNK records of one table, reconstructed by workers that reopen the MDF; at most two chunks
+        # per worker are in flight and results are taken in submission order, so the order is the serial one
+        # and memory stays bounded. Workers of a pool of our own fork with the tables, a shared pool gets each chunk.
+        global _inheritedTables
+        spec = (self.mdf.mssql.filepath, self.mdf.mssql.pagesize, self.mdf.keycolumnsmap,
+            {k: v for k, v in self.mdf.files.filepaths.items() if k != 1})
+        owned = pool is None
+        inherited = owned and multiprocessing.get_start_method() == 'fork'
+        if owned:
+            _inheritedTables = tables
+            pool = carvingPool(numofprocess)
+
+        print('Reconstruct {} tables with {} processes'.format(len(tables), numofprocess))
+        pending = deque()
+        try:
+            for i, (tableinfo, table_scheme, rowinfo, records, template) in enumerate(tables):
+                for start in range(0, len(records), RECOVERY_CHUNK):
+                    chunk = records[start:start + RECOVERY_CHUNK]
+                    table = None if inherited else (table_scheme, rowinfo, chunk, template)
+                    pending.append((tableinfo.tablename, chunk, pool.apply_async(_recoveryTask, ((spec, i, start, table),))))
+                    while len(pending) >= 2 * numofprocess:
+                        tablename, chunk, result = pending.popleft()
+                        yield from zip(chunk, [tablename] * len(chunk), result.get())
+            while len(pending) != 0:
+                tablename, chunk, result = pending.popleft()
+                yield from zip(chunk, [tablename] * len(chunk), result.get())
+        finally:
+            if owned:
+                pool.terminate()
+                pool.join()
+                _inheritedTables = None
+
+    def _reconstructRecord(self, record, template, rowinfo, table_scheme, updates=None):
+        query = False
+        if record.op == Operation.LOP_INSERT_ROWS:
+            query = self._reconstructInsertDeleteRow(record.rowlogcontent[0], rowinfo, table_scheme, template.decode)
+            if query is not False:
+                query = template.renderInsert(query)
+        elif record.op == Operation.LOP_DELETE_ROWS:
+            query = self._reconstructInsertDeleteRow(record.rowlogcontent[0], rowinfo, table_scheme, template.decode)
+            if query is not False:
+                query = template.renderDelete(query)
+        elif record.op == Operation.LOP_MODIFY_ROW:
+            if len(record.rowimages) == 2:
+                query = self._reconstructInsertDeleteRow(record.rowimages[0], rowinfo, table_scheme, template.decode), \
+                    self._reconstructInsertDeleteRow(record.rowimages[1], rowinfo, table_scheme, template.decode)
+            elif updates is not None and id(record) in updates:
+                query = updates[id(record)]
+            else:
+                query = self._reconstructUpdateRow(record, rowinfo, table_scheme, template.decode)
+            if query[0] and query[1]:
+                query = template.renderUpdate(query[0], query[1])
+            else:
+                query = False
+        return query
                     
     def export(self, filename):
         if len(self.queries) != 0:
@@ -739,7 +1205,7 @@ class LogfileParser():
                 wr.writerow(header)
                 wr.writerows(self.queries)
             
-    def _reconstructInsertDeleteRow(self, buf, rowinfo, schemlist):
+    def _reconstructInsertDeleteRow(self, buf, rowinfo, schemlist, decode=None):
         recordlen = len(buf)
         if recordlen < 4:
             return False
@@ -768,7 +1234,7 @@ class LogfileParser():
         coldata = []
         isLob = False
         
-        for schema in schemlist:
+        for colindex, schema in enumerate(schemlist):
             if schema.kindofcol == Columntype.STATIC_COLUMN:
                 columnlength = schema.colsize
                 if schema.datatype == 'bit':
@@ -802,38 +1268,62 @@ class LogfileParser():
                         columnbuff = buf[variableoffset:variableoffset + columnlength]
                         variableoffset += columnlength
                         
+            # offsets above are advanced for every column, only projected columns are decoded
+            if decode is not None and not decode[colindex]:
+                coldata.append(None)
+                isLob = False
+                continue
             output = self._decodeValue(columnbuff, columnlength, schema, numberofbitcol, isLob)
             coldata.append(output)
             isLob = False
         
         return coldata
     
-    def _reconstructUpdateRow(self, record, rowinfo, schemlist):
-        before = record.rowlogcontent[0]
-        after = record.rowlogcontent[1]
-        pageid, _ = unpack('<IH', record.pageid) # limitation fileid = 1
-        buf = self.mdf.mssql.read(pageid * self.mdf.mssql.pagesize, self.mdf.mssql.pagesize)
-        pageheader = self.mdf.mssql.getPageHeader(buf)
-        
-        if pageheader.flagbits & 0x100:
-            buf = self.mdf._tornbits(buf)
-            
-        rowoffsetarray = self.mdf.mssql.getRowOffsetArray(buf, pageheader)
-        fmt = '<' + str(pageheader.slotcnt) + 'H'
-        rowoffsetarray = list(reversed(unpack(fmt, buf[-pageheader.slotcnt * 2:])))
-        recordlen = self._calcDataRecordLen(buf[rowoffsetarray[record.slotid]:], rowinfo)
-        recordbuf = buf[rowoffsetarray[record.slotid]:rowoffsetarray[record.slotid] + recordlen]
+    def _reconstructUpdateRow(self, record, rowinfo, schemlist, decode=None, page=None):
+        if len(record.rowlogcontent) > 1:
+            before = record.rowlogcontent[0]
+            after = record.rowlogcontent[1]
+        else:
+            return False, False
+        if page is None:
+            pageid, fileid = unpack('<IH', record.pageid)
+            page = _readDataPage(self.mdf, pageid, fileid)
+        row = self.mdf.locateRow(record.partitionid, schemlist, _loggedKey(record), record.slotid, page)
+        if row is None:
+            return False, False
+        buf, offset = row
+        recordlen = self._calcDataRecordLen(buf[offset:], rowinfo)
+        recordbuf = buf[offset:offset + recordlen]
         
-        after_coldata = self._reconstructInsertDeleteRow(recordbuf, rowinfo, schemlist)
+        after_coldata = self._reconstructInsertDeleteRow(recordbuf, rowinfo, schemlist, decode)
         before_recordbuf = recordbuf[:record.offsetinrow] + recordbuf[record.offsetinrow:record.offsetinrow+len(after)].replace(after, before) + \
             recordbuf[record.offsetinrow+len(after):]
-        before_coldata = self._reconstructInsertDeleteRow(before_recordbuf, rowinfo, schemlist)
+        before_coldata = self._reconstructInsertDeleteRow(before_recordbuf, rowinfo, schemlist, decode)
         
         if after_coldata is False or before_coldata is False:
             return False, False
         
         return after_coldata, before_coldata 
     
+    def _chainRowVersions(self, records, rowinfo, table_scheme):
+        # before / after images of MODIFY_ROW records from the log itself, the MDF is read only
+        # for rows whose history does not start with an INSERT (one read per page, ascending)
+        versions = RowVersions()
+        for record in sorted(records, key=lambda x: (x.vlfseqnum, x.blocknum, x.slotnum)):
+            versions.apply(record)
+
+        for page, keys in _pageGroups(self.mdf, list(versions.pending), lambda x: x[0]):
+            for key in keys:
+                last = versions.pending[key][-1]
+                row = self.mdf.locateRow(last.partitionid, table_scheme, _loggedKey(last), key[1], page)
+                if row is None:
+                    continue
+                buf, offset = row
+                recordlen = self._calcDataRecordLen(buf[offset:], rowinfo)
+                if recordlen == 0:
+                    continue
+                versions.chainBackward(versions.pending[key], buf[offset:offset + recordlen])
+
     def _calcDataRecordLen(self, buf, rowinfo):
         offsetOftotalNumOfCol = unpack('<H', buf[0x02:0x04])[0]
         totalNumOfCol = unpack('<H', buf[offsetOftotalNumOfCol:offsetOftotalNumOfCol + 0x02])[0]
@@ -876,7 +1366,6 @@ class LogfileParser():
         
         return retVal
         
-    @classmethod
     def _decodeValue(self, buf, length, schema, numberofbitcol, isLob):
         output = ''
         if schema.datatype == "tinyint":
@@ -904,24 +1393,21 @@ class LogfileParser():
             output = "'" + buf.decode('utf8') + "'"
         elif schema.datatype == "varchar":
             if isLob: # Large object
-                output = ""
-                #output = "'" + self._parseLobRecord(buf).decode('utf8') + "'"
+                output = _decodeLob(self, buf, 'utf8')
             else:
                 output = "'" + buf.decode('utf8', errors="ignore") + "'"
         elif schema.datatype == "nchar":
             output = "'" + buf.decode('utf16') + "'" # xml, text, ntext, image
         elif schema.datatype == "nvarchar":
             if isLob: # Large object
-                output = ""
-                #output = "'" + self._parseLobRecord(buf).decode('utf16') + "'"
+                output = _decodeLob(self, buf, 'utf-16-le')
             else:
                 output = "'" + buf.decode('utf16') + "'" # hierarchyid, geometry, geography, uniqueidentifier, sql_variant
         elif schema.datatype == "binary":
             output = '0x' + (binascii.b2a_hex(buf)).decode('utf8')
         elif schema.datatype == "varbinary":
             if isLob: # 8bytes => lob header (type(2 byptes) / level(1 byte) / unused(1 byte) / updateseq(4 bytes))              
-                output = '0x'
-                #output = '0x' + (binascii.b2a_hex(self._parseLobRecord(buf))).decode('utf8')
+                output = _decodeLob(self, buf, None)
             else:
                 output = '0x' + (binascii.b2a_hex(buf)).decode('utf8')
         # text, ntext, image
@@ -988,44 +1474,413 @@ class LogfileParser():
         recordoffsetarray = list(filter(lambda x: x!= 0, recordoffsetarray))
         return recordoffsetarray
             
-def carving(filepath, start, end, chunksize, hitOffset):
+CARVING_WINDOW = 4 * 1024 * 1024 # bytes read and scanned at once
+CARVING_UNIT = 64 * 1024 * 1024 # bytes handed to a worker at once
+SIG_OVERLAP = 0x18 # header bytes scanSig needs past a hit (up to the op byte at 0x16)
+
+def isRotational(filepath):
+    # Linux only: /sys/dev/block/<major>:<minor> of the device holding the file (or its parent disk)
+    dev = os.stat(filepath).st_dev
+    path = '/sys/dev/block/{}:{}'.format(os.major(dev), os.minor(dev))
+    for queue in [os.path.join(path, 'queue', 'rotational'), os.path.join(path, '..', 'queue', 'rotational')]:
+        try:
+            with open(queue, 'r') as f:
+                return f.read().strip() == '1'
+        except:
+            continue
+    return None
+
+def carvingWorkers(filepath):
+    numofcpu = os.cpu_count() or 1
+    if isRotational(filepath):
+        return min(numofcpu, 2) # more readers only make the disk seek
+    return numofcpu
+
+def _carvingTask(args):
+    start_time = time.perf_counter()
+    result = args[0](*args[1:])
+    return os.getpid(), args[2], time.perf_counter() - start_time, result
+
+_carvingShared = None # (bytes scanned, cancel flag) of the parent, set in pool workers
+
+def _carvingInit(scanned, cancel):
+    # Ctrl-C is handled by the parent only, which sets the cancel flag or terminates the pool
+    global _carvingShared
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _carvingShared = (scanned, cancel)
+
+def _carvingScanned(nbytes):
+    if _carvingShared is not None:
+        with _carvingShared[0].get_lock():
+            _carvingShared[0].value += nbytes
+
+def _carvingCancelled():
+    return _carvingShared is not None and _carvingShared[1].value != 0
+
+def carvingPool(numofprocess):
+    scanned = multiprocessing.Value('q', 0)
+    cancel = multiprocessing.Value('b', 0)
+    pool = Pool(numofprocess, initializer=_carvingInit, initargs=(scanned, cancel))
+    pool.scanned = scanned
+    pool.cancel = cancel
+    return pool
+
+PROGRESS_INTERVAL = 2 # seconds between overall progress lines
+PROGRESS_DETAIL = 30 # seconds between per-worker progress lines
+
+class CarvingProgress():
+    def __init__(self, total, interval=PROGRESS_INTERVAL, detail=PROGRESS_DETAIL):
+        self.total = total
+        self.done = 0
+        self.hits = 0
+        self.workers = dict() # pid -> [bytes, hits, busy seconds, ranges]
+        self.interval = interval
+        self.detail = detail
+        self.start_time = time.perf_counter()
+        self.last_time = 0.0
+        self.last_detail = 0.0
+        self.last_done = 0 # bytes at the last overall line
+
+    def update(self, pid, nbytes, nhits, elapsed, done=None):
+        # a finished range; done: bytes scanned by all workers so far when they count them per window
+        self.hits += nhits
+        worker = self.workers.setdefault(pid, [0, 0, 0.0, 0])
+        worker[0] += nbytes
+        worker[1] += nhits
+        worker[2] += elapsed
+        worker[3] += 1
+        self.tick(self.done + nbytes if done is None else done)
+
+    def tick(self, done=None):
+        if done is not None:
+            self.done = done
+        now = time.perf_counter() - self.start_time
+        if now - self.last_time >= self.interval or self.done >= self.total > self.last_done:
+            self.last_time = now
+            self.last_done = self.done
+            self.printOverall(now)
+        if now - self.last_detail >= self.detail:
+            self.last_detail = now
+            self.printWorkers()
+
+    def printOverall(self, now=None):
+        if now is None:
+            now = time.perf_counter() - self.start_time
+        rate = self.done / now if now > 0 else 0
+        eta = (self.total - self.done) / rate if rate > 0 else 0
+        print('[Progress] {:.2f}/{:.2f} GB ({:.1f}%), {:.2f} GB/s, {} hits ({:.0f} hits/s), ETA {}'.format(
+            self.done / (1 << 30), self.total / (1 << 30), self.done * 100 / self.total if self.total else 100,
+            rate / (1 << 30), self.hits, self.hits / now if now > 0 else 0, timedelta(seconds=int(eta))))
+
+    def printWorkers(self):
+        # throughput of each worker over the time it spent on its ranges
+        for pid, (nbytes, nhits, busy, ranges) in sorted(self.workers.items()):
+            print('[Progress]   worker {}: {} ranges, {:.2f} GB, {:.2f} GB/s, {:.0f} hits/s'.format(
+                pid, ranges, nbytes / (1 << 30), nbytes / busy / (1 << 30) if busy > 0 else 0, nhits / busy if busy > 0 else 0))
+
+
+RECOVERY_CHUNK = 10000 # log records reconstructed by a worker at once
+
+_inheritedTables = None # tables of the recovery that forked the pool
+_recoveryParsers = dict() # MDF path -> parser of a worker, reused by every chunk of that MDF
+
+def _recoveryParser(spec):
+    filepath, pagesize, keycolumnsmap, secondaries = spec
+    if filepath not in _recoveryParsers:
+        df = Datafile()
+        df.open(filepath)
+        df.pagesize = pagesize
+        dp = DatafileParser(df)
+        for fileid, secondary in secondaries.items():
+            dp.files.filepaths[fileid] = secondary # opened on first read
+        _recoveryParsers[filepath] = LogfileParser(None, dp)
+    parser = _recoveryParsers[filepath]
+    parser.mdf.keycolumnsmap = keycolumnsmap # for key seeks
+    return parser
+
+def _recoveryTask(args):
+    spec, i, start, table = args
+    if table is None:
+        _, table_scheme, rowinfo, records, template = _inheritedTables[i]
+        records = records[start:start + RECOVERY_CHUNK]
+    else:
+        table_scheme, rowinfo, records, template = table
+    return _recoveryParser(spec)._recoverChunk(records, template, rowinfo, table_scheme)
+
+def dataExtents(fd, start, end, align):
+    # allocated ranges of a sparse file (SEEK_DATA / SEEK_HOLE), widened to align and clipped to [start, end)
+    if not hasattr(os, 'SEEK_DATA'):
+        return [(start, end)]
+
+    extents = []
+    offset = start
+    try:
+        while offset < end:
+            datastart = os.lseek(fd, offset, os.SEEK_DATA)
+            if datastart >= end:
+                break
+            dataend = min(os.lseek(fd, datastart, os.SEEK_HOLE), end)
+            datastart = max(start, datastart - datastart % align)
+            dataend = min(end, dataend + (align - dataend % align) % align)
+            if extents and datastart <= extents[-1][1]:
+                extents[-1] = (extents[-1][0], dataend)
+            else:
+                extents.append((datastart, dataend))
+            offset = dataend
+    except OSError as e:
+        if e.errno == errno.ENXIO: # no data after offset
+            return extents
+        return [(start, end)] # not supported by the file system
+    return extents
+
+def liveSpans(buf, size, clustersize):
+    # clusters holding one repeated byte (zeros, filler) cannot contain a header, merge the rest into spans
+    spans = []
+    for offset in range(0, size, clustersize):
+        length = min(clustersize, size - offset)
+        if buf.count(buf[offset:offset + 1], offset, offset + length) == length:
+            continue
+        if spans and spans[-1][1] == offset:
+            spans[-1][1] = offset + length
+        else:
+            spans.append([offset, offset + length])
+    return spans
+
+def carving(filepath, start, end, chunksize, windowsize=CARVING_WINDOW):
     fHandle = open(filepath, 'rb')
-    
-    offset = start * chunksize
-    while offset < end * chunksize:
-        fHandle.seek(offset)
-        buf = fHandle.read(chunksize)
-        offsetList = scanSig(buf, chunksize)
-        addOffset(hitOffset, offsetList, offset)
-        offset += chunksize        
-        
+    hitOffset = array('Q')
+    hitTranid = bytearray()
+    hitOp = bytearray()
+
+    # windows overlap by SIG_OVERLAP so a header crossing the window edge is still matched,
+    # hits inside the overlap belong to the next window (or the next worker's range)
+    startoffset = start * chunksize
+    endoffset = min(end * chunksize, os.fstat(fHandle.fileno()).st_size)
+    scanned = 0
+    windowed = 0
+    for datastart, dataend in dataExtents(fHandle.fileno(), startoffset, endoffset, chunksize):
+        offset = datastart
+        while offset < dataend and not _carvingCancelled():
+            size = min(windowsize, dataend - offset)
+            fHandle.seek(offset)
+            buf = fHandle.read(size + SIG_OVERLAP)
+            if not buf:
+                break
+            size = min(size, len(buf))
+            view = memoryview(buf)
+            for spanstart, spanend in liveSpans(buf, size, chunksize):
+                scanned += spanend - spanstart
+                for _off, tranid in scanSig(view[spanstart:spanend + SIG_OVERLAP], spanend + SIG_OVERLAP - spanstart):
+                    if spanstart + _off < spanend:
+                        hitOffset.append(offset + spanstart + _off)
+                        hitTranid += tranid
+                        hitOp.append(buf[spanstart + _off + 0x16])
+            del view
+            offset += size
+            windowed += size
+            _carvingScanned(size) # progress per window
+    fHandle.close()
+    skipped = max(0, endoffset - startoffset) - scanned # bytes of holes and constant-fill clusters
+    _carvingScanned(max(0, endoffset - startoffset) - windowed) # holes
+
+    return hitOffset, bytes(hitTranid), bytes(hitOp), skipped
+
+LOGBLOCK_SIZE = 512
+LOGBLOCK_MAX = 0xF000 # 60 KB
+LOGBLOCK_HEADER = 0x48
+
+def checkLogBlock(buf):
+    # buf: candidate log block with the sector fixup already applied
+    if len(buf) < LOGBLOCK_HEADER:
+        return False
+    slotNum, segSize = unpack('<HH', buf[0x02:0x06])
+    if slotNum == 0 or segSize > len(buf) or segSize < LOGBLOCK_HEADER + slotNum * 2:
+        return False
+    if unpack('<i', buf[0x0C:0x10])[0] <= 0: # first LSN: VLF sequence number
+        return False
+
+    recordoffsetarray = LogfileParser._getRecordOffsetArray(buf[:segSize], slotNum)
+    if len(recordoffsetarray) == 0 or len(set(recordoffsetarray)) != len(recordoffsetarray):
+        return False
+    for offset in recordoffsetarray:
+        if offset < LOGBLOCK_HEADER or offset + 0x18 > segSize - slotNum * 2:
+            return False
+        if buf[offset + 0x16] not in _operations:
+            return False
+    return True
+
+def carvingBlocks(filepath, start, end, chunksize, windowsize=CARVING_WINDOW):
+    fHandle = open(filepath, 'rb')
+    blockOffset = array('Q')
+    blockLength = array('I')
+
+    # a block may run past the window, so windows overlap by the largest block size
+    startoffset = start * chunksize
+    endoffset = min(end * chunksize, os.fstat(fHandle.fileno()).st_size)
+    scanned = 0
+    for datastart, dataend in dataExtents(fHandle.fileno(), startoffset, endoffset, chunksize):
+        offset = datastart
+        while offset < dataend and not _carvingCancelled():
+            size = min(windowsize, dataend - offset)
+            fHandle.seek(offset)
+            buf = fHandle.read(size + LOGBLOCK_MAX)
+            if not buf:
+                break
+            size = min(size, len(buf))
+            scanned += size
+
+            blkoffset = 0
+            while blkoffset < size:
+                if buf[blkoffset] in (0x50, 0x58) and blkoffset + LOGBLOCK_HEADER <= len(buf):
+                    segSize = unpack('<H', buf[blkoffset + 0x04:blkoffset + 0x06])[0]
+                    length = min(LOGBLOCK_MAX, segSize + (LOGBLOCK_SIZE - segSize % LOGBLOCK_SIZE) % LOGBLOCK_SIZE)
+                    if segSize != 0 and blkoffset + length <= len(buf) and \
+                        checkLogBlock(LogfileParser._fixup(buf[blkoffset:blkoffset + length], LOGBLOCK_SIZE)):
+                        blockOffset.append(offset + blkoffset)
+                        blockLength.append(length)
+                        blkoffset += length
+                        continue
+                blkoffset += LOGBLOCK_SIZE
+            offset += size
+            _carvingScanned(size) # progress per window
+    fHandle.close()
+    skipped = max(0, endoffset - startoffset) - scanned
+    _carvingScanned(skipped) # holes
+
+    return blockOffset, blockLength, skipped
+
+# flag byte, fixed length and op of INSERT_ROWS / DELETE_ROWS / MODIFY_ROW, BEGIN_XACT and COMMIT_XACT headers
+_sigFlags = [0x00, 0x40, 0x48, 0x80, 0x88]
+_sigPattern = re.compile(
+    rb'(?=[\x00\x40\x48\x80\x88]\x00'
+    rb'(?:\x3E\x00.{18}[\x02-\x04]'
+    rb'|\x4C\x00.{18}\x80'
+    rb'|\x50\x00.{18}\x81))', re.DOTALL)
+
+if np is not None:
+    _sigFlagTable = np.zeros(256, dtype=bool)
+    _sigFlagTable[_sigFlags] = True
+
 def scanSig(buf, size):
-    sig1 = [b'\x00\x00\x3E\x00', b'\x40\x00\x3E\x00', b'\x48\x00\x3E\x00', b'\x80\x00\x3E\x00', b'\x88\x00\x3E\x00']
-    op1 = [2, 3, 4] # INSERT_ROWS / DELETE_ROWS / MODIFY_ROW
-    sig2 = [b'\x00\x00\x4C\x00', b'\x40\x00\x4C\x00', b'\x48\x00\x4C\x00', b'\x80\x00\x4C\x00', b'\x88\x00\x4C\x00']
-    op2 = 128 # BEGIN_XACT
-    sig3 = [b'\x00\x00\x50\x00', b'\x40\x00\x50\x00', b'\x48\x00\x50\x00', b'\x80\x00\x50\x00', b'\x88\x00\x50\x00']
-    op3 = 129 # COMMIT_XACT
-    opOffset = 0x16
+    if np is None:
+        return _scanSigRegex(buf, size)
+
+    # every header is 4-byte aligned: word = flag | 0x00 << 8 | fixed length << 16 | 0x00 << 24, op at 0x16
+    size = min(size, len(buf))
+    ops = np.frombuffer(buf, dtype=np.uint8, count=size)[0x16::4]
+    words = np.frombuffer(buf, dtype='<u4', count=size // 4)[:len(ops)]
+
+    header = words & 0xFFFFFF00
+    matched = header == 0x003E0000
+    matched |= header == 0x004C0000
+    matched |= header == 0x00500000
+    candidate = np.flatnonzero(matched)
+    if len(candidate) == 0:
+        return []
+
+    fixed = header[candidate] >> 16
+    op = ops[candidate]
+    valid = _sigFlagTable[words[candidate] & 0xFF] & (
+        ((fixed == 0x3E) & (op >= 2) & (op <= 4)) | # INSERT_ROWS / DELETE_ROWS / MODIFY_ROW
+        ((fixed == 0x4C) & (op == 128)) | # BEGIN_XACT
+        ((fixed == 0x50) & (op == 129))) # COMMIT_XACT
+
+    offsetList = []
+    for offset in (candidate[valid] * 4).tolist():
+        offsetList.append([offset, buf[offset + 0x10:offset + 0x16]])
+
+    return offsetList
+
+def _scanSigRegex(buf, size):
     byteUnit = 4 # 4 바이트 단위로 파싱 진행
-    offset = 0
-    
+
     offsetList = []
-    while offset + opOffset < size:
-        if buf[offset:offset + 0x04] in sig1 and buf[offset + opOffset] in op1:
-            offsetList.append([offset, buf[offset + 0x10:offset + 0x16]])  
-        elif buf[offset:offset + 0x04] in sig2 and buf[offset + opOffset] == op2:
-            offsetList.append([offset, buf[offset + 0x10:offset + 0x16]])
-        elif buf[offset:offset + 0x04] in sig3 and buf[offset + opOffset] == op3:
+    for matched in _sigPattern.finditer(buf, 0, size):
+        offset = matched.start()
+        if offset % byteUnit == 0:
             offsetList.append([offset, buf[offset + 0x10:offset + 0x16]])
-        offset += byteUnit
-        
+
     return offsetList
 
-def addOffset(hitOffset, offsetList, offset):
-    for _off, tranid in offsetList:
-        hitOffset[offset + _off] = tranid
-    
+MAX_NUMELEMENTS = 16 # row log contents per INSERT_ROWS / DELETE_ROWS / MODIFY_ROW record
+MAX_LOGRECORD = 0xF000 # a log record never crosses a 60 KB log block
+VALIDATE_BATCH = 1 << 16 # candidates per NumPy pass, bounds the gathered header fields
+
+def validateHits(image, offsets, ops, partitionids=None):
+    # plausibility of carved headers before any per-record parsing:
+    # fixed length per op, numelements bounds, record length inside the image, previous LSN, partition id
+    if np is not None:
+        keep = []
+        for i in range(0, len(offsets), VALIDATE_BATCH):
+            keep.extend(_validateHitsNumpy(image, offsets[i:i + VALIDATE_BATCH], ops[i:i + VALIDATE_BATCH], partitionids).tolist())
+        return keep
+    return [_validateHit(image, offset, op, partitionids) for offset, op in zip(offsets, ops)]
+
+def _validateHit(image, offset, op, partitionids):
+    size = len(image)
+    if offset + 0x40 > size:
+        return False
+    fixedlength = unpack_from('<H', image, offset + 0x02)[0]
+    if fixedlength != {2: 0x3E, 3: 0x3E, 4: 0x3E, 128: 0x4C, 129: 0x50}.get(op):
+        return False
+    previousLSN = unpack_from('<iih', image, offset + 0x04)
+    if previousLSN != (0, 0, 0) and (previousLSN[0] <= 0 or previousLSN[1] < 0 or previousLSN[2] <= 0):
+        return False
+    if op not in (2, 3, 4): # BEGIN_XACT / COMMIT_XACT
+        return offset + fixedlength <= size
+
+    numelements = image[offset + 0x3E]
+    if numelements == 0 or numelements > MAX_NUMELEMENTS or offset + 0x40 + numelements * 2 > size:
+        return False
+    recordlen = fixedlength + 2 + numelements * 2 + (numelements * 2) % 4
+    for length in unpack_from('<' + str(numelements) + 'H', image, offset + 0x40):
+        if length != 0:
+            recordlen += (length + 4 - length % 4)
+    if recordlen > MAX_LOGRECORD or offset + recordlen > size:
+        return False
+    if partitionids and unpack_from('<Q', image, offset + 0x30)[0] not in partitionids:
+        return False
+    return True
+
+def _validateHitsNumpy(image, offsets, ops, partitionids):
+    img = np.frombuffer(image, dtype=np.uint8)
+    size = len(img)
+    offsets = np.frombuffer(offsets, dtype=np.uint64).astype(np.int64)
+    ops = np.frombuffer(ops, dtype=np.uint8)
+    if len(offsets) == 0:
+        return np.zeros(0, dtype=bool)
+
+    # gather only the checked header fields of every candidate (clamped so short tails never index past the image)
+    valid = offsets + 0x40 <= size
+    base = np.where(valid, offsets, 0)
+    field = lambda start, dtype: np.ascontiguousarray(img[base[:, None] + start + np.arange(np.dtype(dtype).itemsize)]).view(dtype).ravel()
+
+    fixedlength = field(0x02, '<u2')
+    isrow = (ops >= 2) & (ops <= 4)
+    valid &= np.where(isrow, fixedlength == 0x3E, np.where(ops == 128, fixedlength == 0x4C, (ops == 129) & (fixedlength == 0x50)))
+
+    lsnvlf, lsnblock, lsnslot = field(0x04, '<i4'), field(0x08, '<i4'), field(0x0C, '<i2')
+    nolsn = (lsnvlf == 0) & (lsnblock == 0) & (lsnslot == 0)
+    valid &= nolsn | ((lsnvlf > 0) & (lsnblock >= 0) & (lsnslot > 0))
+
+    # BEGIN_XACT / COMMIT_XACT: fixed part only
+    valid &= isrow | (offsets + fixedlength <= size)
+
+    numelements = img[base + 0x3E].astype(np.int64)
+    valid &= ~isrow | ((numelements > 0) & (numelements <= MAX_NUMELEMENTS) & (offsets + 0x40 + numelements * 2 <= size))
+    recordlen = fixedlength.astype(np.int64) + 2 + numelements * 2 + (numelements * 2) % 4
+    for k in range(MAX_NUMELEMENTS):
+        index = np.minimum(base + 0x40 + k * 2, size - 2)
+        length = img[index].astype(np.int64) | (img[index + 1].astype(np.int64) << 8)
+        length = np.where((k < numelements) & (base + 0x40 + k * 2 + 2 <= size), length, 0)
+        recordlen += np.where(length != 0, length + 4 - length % 4, 0)
+    valid &= ~isrow | ((recordlen <= MAX_LOGRECORD) & (offsets + recordlen <= size))
+
+    if partitionids:
+        partitionid = field(0x30, '<u8')
+        valid &= ~isrow | np.isin(partitionid, np.array(sorted(partitionids), dtype=np.uint64))
+    return valid
+
 def main():
     print('MSSQL Log Record Parser Tool (version 1.0)')
     ldf = Logfile()
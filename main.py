@@ -1,56 +1,80 @@
 import sys
 import argparse
 
-from datafile import Datafile, DatafileParser
-from logfile import Logfile, LogfileParser, CarvingProcess
+from batch import BatchRunner, loadCatalog, loadProjection, runJob
+from sink import openSink, SINK_FORMATS
 
 
 def main():
-    
+
     parser = argparse.ArgumentParser()
     parser.add_argument("-d", "--data", dest="datafile", action="store")
+    parser.add_argument("-n", "--ndf", dest="secondaries", action="append") # secondary data file, repeatable
     parser.add_argument("-l", "--log", dest="logfile", action="store")
-    parser.add_argument("-m", "--mode", dest="mode", action="store") 
+    parser.add_argument("-m", "--mode", dest="mode", action="store")
     # 0b00 = only LDF, 0b01 = LDF with MDF, 0b10 = only unallocated area, 0b11 = unallocated area with MDF
+    # 0b110 = only unallocated area (log blocks), 0b111 = unallocated area (log blocks) with MDF
+    parser.add_argument("-i", "--hitindex", dest="hitfile", action="store")
+    parser.add_argument("-w", "--workers", dest="workers", action="store", type=int)
+    parser.add_argument("-b", "--batch", dest="manifest", action="store")
+    parser.add_argument("-j", "--cpus", dest="cpus", action="store", type=int)
+    parser.add_argument("-r", "--report", dest="report", action="store")
+    parser.add_argument("-p", "--parallel", dest="recoveryworkers", action="store", type=int) # processes reconstructing tables of an LDF
+    parser.add_argument("-k", "--keyonly", dest="keyonly", action="store_true") # WHERE on clustered index key columns only
+    parser.add_argument("-c", "--columns", dest="columns", action="append") # table:col,col or JSON file, repeatable
+    parser.add_argument("-H", "--history", dest="history", action="store") # partitionid:pageid:slotid[:fileid]
+    parser.add_argument("-a", "--iam", dest="iam", action="store_true") # MDF pages from IAM chains instead of a full scan
+    parser.add_argument("-o", "--output", dest="output", action="store") # '-' = stdout
+    parser.add_argument("-f", "--format", dest="format", action="store", default='csv', choices=sorted(SINK_FORMATS))
     args = parser.parse_args()
+
+    if args.manifest:
+        br = BatchRunner(args.manifest, args.cpus)
+        if br.load() != True:
+            sys.exit()
+        br.run()
+        br.report(args.report)
+        print('Complete')
+        return
+
     mode = int(args.mode)
-    
+
+    columns = loadProjection(args.columns)
+    if columns is None:
+        sys.exit()
+
+    history = None
+    if args.history:
+        try:
+            history = [int(x, 0) for x in args.history.split(':')]
+        except ValueError:
+            history = []
+        if len(history) not in (3, 4):
+            print('Invalid row : ' + args.history)
+            sys.exit()
+
+    sink = None
+    if args.output:
+        sink = openSink(args.output, args.format)
+        if sink is None:
+            sys.exit()
+        if args.output == '-':
+            sys.stdout = sys.stderr # keep messages out of the piped output
+
+    dp = None
     if mode & 1:
-        df = Datafile()
-        df.open(args.datafile)
-        dp = DatafileParser(df)
-        dp.scanPages(args.datafile)
-        dp.getSystemTableColumnInfo()
-        if dp.getTableInfo() != True:
+        dp = loadCatalog(args.datafile, args.iam, args.secondaries)
+        if dp is None:
             sys.exit()
-        dp.getColumnInfo()
-        dp.getKeyColumninfo()
-        dp.getPageObjectId() # Extract table information
-        if mode & 2:
-            cp = CarvingProcess(args.logfile, 4096)
-            cp.open()
-            cp.process()
-            cp.recovery(dp)
-        else:
-            lf = Logfile()
-            lf.open(args.logfile)
-            lp = LogfileParser(lf, dp)
-            lp.scanVLFs()
-            lp.scanLogSegment()
-            lp.parseVLF()
-            lp.recovery()
-    else:
-        if mode & 2:
-            cp = CarvingProcess(args.logfile, 4096)
-            cp.open()
-            cp.process()
-        else:
-            lf = Logfile()
-            lf.open(args.logfile)
-            lp = LogfileParser(lf)
-            lp.scanVLFs()
-            lp.scanLogSegment()
-            lp.parseVLF()
+    try:
+        runJob(mode, args.logfile, dp, workers=args.workers, hitfile=args.hitfile, sink=sink, recoveryworkers=args.recoveryworkers, keyonly=args.keyonly, columns=columns, history=history)
+    except KeyboardInterrupt:
+        print('[Cancel] Stopped by user')
+    finally:
+        # statements written before a Ctrl-C are flushed
+        if sink is not None:
+            sink.close()
+            print('Write {} statements and {} raw records to {}'.format(sink.statements, sink.raws, args.output))
     print('Complete')
 
 
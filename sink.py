@@ -0,0 +1,206 @@
+import sys
+import json
+import sqlite3
+import binascii
+import unicodecsv as csv
+
+from abc import ABC, abstractmethod
+from enum import Enum
+
+SINK_BUFFER = 1024 # rows held before they are written out
+
+# Output targets of recovery: statements are handed over as soon as they are reconstructed,
+# log records that could not be reconstructed are written as raw row log contents
+class Sink(ABC):
+    def __init__(self, stream, bufsize=SINK_BUFFER):
+        self.stream = stream
+        self.bufsize = bufsize
+        self.buffer = []
+        self.closed = False
+        self.owned = True # False for stdout, which is left open
+        self.statements = 0
+        self.raws = 0
+
+    def writeStatement(self, begintime, endtime, record, tablename, query):
+        self.statements += 1
+        return self._write(self._row('statement', begintime, endtime, record, tablename, query))
+
+    def writeRaw(self, begintime, endtime, record, tablename):
+        self.raws += 1
+        return self._write(self._row('raw', begintime, endtime, record, tablename, None))
+
+    def _write(self, row):
+        # a full buffer is written before recovery goes on, so a slow consumer slows the producer down
+        if self.closed:
+            return False
+        self.buffer.append(row)
+        if len(self.buffer) >= self.bufsize:
+            return self.flush()
+        return True
+
+    def flush(self):
+        if self.closed:
+            return False
+        try:
+            self._writeRows(self.buffer)
+            if self.stream is not None:
+                self.stream.flush()
+        except BrokenPipeError:
+            # the consumer of a pipe went away, nothing more can be delivered
+            print('[Warning] Output pipe closed', file=sys.stderr)
+            self.closed = True
+            return False
+        finally:
+            self.buffer = []
+        return True
+
+    def close(self):
+        self.flush()
+        self.closed = True
+        if self.owned:
+            self.stream.close()
+
+    @classmethod
+    def _row(self, rowtype, begintime, endtime, record, tablename, query):
+        row = dict()
+        row['type'] = rowtype
+        row['begintime'] = begintime
+        row['endtime'] = endtime
+        row['op'] = record.op.name if isinstance(record.op, Enum) else str(record.op)
+        row['table'] = tablename
+        row['transactionid'] = binascii.b2a_hex(bytes(record.transactionid)).decode('utf8')
+        row['lsn'] = '{:08x}:{:08x}:{:04x}'.format(record.vlfseqnum, record.blocknum, record.slotnum)
+        row['offset'] = record.offset
+        row['query'] = query
+        row['rowlogcontent'] = None
+        if query is None:
+            row['rowlogcontent'] = [binascii.b2a_hex(bytes(x)).decode('utf8') for x in record.rowlogcontent]
+        return row
+
+    @abstractmethod
+    def _writeRows(self, rows):
+        pass
+
+class CsvSink(Sink):
+    header = ['Type', 'Begin Time', 'End Time', 'Op', 'Table', 'Transaction ID', 'LSN', 'Offset', 'Query', 'Row Log Contents']
+
+    def __init__(self, stream, bufsize=SINK_BUFFER):
+        super().__init__(stream, bufsize)
+        self.writer = csv.writer(stream, encoding='utf-8')
+        self.headerwritten = False
+
+    def _writeRows(self, rows):
+        if not self.headerwritten:
+            self.headerwritten = True
+            self.writer.writerow(self.header)
+        self.writer.writerows([[row['type'], row['begintime'], row['endtime'], row['op'], row['table'], row['transactionid'],
+                                row['lsn'], row['offset'], row['query'] or '', ' '.join(row['rowlogcontent'] or [])] for row in rows])
+
+class JsonLinesSink(Sink):
+    def _writeRows(self, rows):
+        self.stream.write(''.join(json.dumps(row, ensure_ascii=False) + '\n' for row in rows).encode('utf8'))
+
+SQLITE_BATCH = 50000 # rows per executemany transaction
+
+class SqliteSink(Sink):
+    def __init__(self, filename, bufsize=SQLITE_BATCH):
+        super().__init__(None, bufsize)
+        self.owned = False
+        self.rawid = 0
+        self.conn = sqlite3.connect(filename)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        # a re-run replaces the previous output instead of appending a second copy
+        self.conn.executescript('''
+            DROP TABLE IF EXISTS statements;
+            DROP TABLE IF EXISTS raws;
+            DROP TABLE IF EXISTS rowlogcontents;
+            DROP TABLE IF EXISTS transactions;
+            CREATE TABLE IF NOT EXISTS statements (tablename TEXT, begintime TEXT, endtime TEXT, txid TEXT, op TEXT, lsn TEXT, offset INTEGER, query TEXT);
+            CREATE TABLE IF NOT EXISTS raws (rawid INTEGER PRIMARY KEY, tablename TEXT, begintime TEXT, endtime TEXT, txid TEXT, op TEXT, lsn TEXT, offset INTEGER);
+            CREATE TABLE IF NOT EXISTS rowlogcontents (rawid INTEGER, idx INTEGER, content BLOB);
+            CREATE TABLE IF NOT EXISTS transactions (txid TEXT, begintime TEXT, endtime TEXT, statements INTEGER, raws INTEGER);
+        ''')
+
+    @classmethod
+    def _isoTime(self, value):
+        # '%m/%d/%Y %H:%M:%S.%f' -> '%Y-%m-%d %H:%M:%S.%f' so that times sort and compare as text
+        if value == '':
+            return None
+        if len(value) < 19:
+            return value
+        return value[6:10] + '-' + value[0:2] + '-' + value[3:5] + value[10:]
+
+    def _writeRows(self, rows):
+        statements = []
+        raws = []
+        contents = []
+        for row in rows:
+            values = (row['table'], self._isoTime(row['begintime']), self._isoTime(row['endtime']), row['transactionid'], row['op'], row['lsn'], row['offset'])
+            if row['type'] == 'statement':
+                statements.append(values + (row['query'],))
+            else:
+                self.rawid += 1
+                raws.append((self.rawid,) + values)
+                contents.extend((self.rawid, i, bytes.fromhex(x)) for i, x in enumerate(row['rowlogcontent']))
+
+        # one transaction per batch
+        with self.conn:
+            self.conn.executemany('INSERT INTO statements VALUES (?, ?, ?, ?, ?, ?, ?, ?)', statements)
+            self.conn.executemany('INSERT INTO raws VALUES (?, ?, ?, ?, ?, ?, ?, ?)', raws)
+            self.conn.executemany('INSERT INTO rowlogcontents VALUES (?, ?, ?)', contents)
+
+    def close(self):
+        if self.conn is None:
+            return
+        super().close()
+
+        # transactions and indexes are built once the load is finished
+        with self.conn:
+            self.conn.executescript('''
+                DELETE FROM transactions;
+                INSERT INTO transactions
+                    SELECT txid, min(begintime), max(endtime), sum(statement), sum(raw) FROM (
+                        SELECT txid, begintime, endtime, 1 AS statement, 0 AS raw FROM statements
+                        UNION ALL
+                        SELECT txid, begintime, endtime, 0, 1 FROM raws)
+                    GROUP BY txid;
+                CREATE INDEX IF NOT EXISTS statements_table_begintime ON statements (tablename, begintime);
+                CREATE INDEX IF NOT EXISTS statements_txid ON statements (txid);
+                CREATE INDEX IF NOT EXISTS statements_op ON statements (op);
+                CREATE INDEX IF NOT EXISTS raws_table_begintime ON raws (tablename, begintime);
+                CREATE INDEX IF NOT EXISTS raws_txid ON raws (txid);
+                CREATE INDEX IF NOT EXISTS raws_op ON raws (op);
+                CREATE INDEX IF NOT EXISTS rowlogcontents_rawid ON rowlogcontents (rawid);
+                CREATE INDEX IF NOT EXISTS transactions_txid ON transactions (txid);
+            ''')
+        self.conn.close()
+        self.conn = None
+
+SINK_FORMATS = {'csv': CsvSink, 'jsonl': JsonLinesSink, 'sqlite': SqliteSink}
+
+def openSink(filename, fmt='csv', bufsize=None):
+    # '-' streams to stdout so the output can be piped into another tool
+    if fmt not in SINK_FORMATS:
+        print('Unknown output format: ' + fmt)
+        return None
+    if fmt == 'sqlite':
+        if filename == '-':
+            print('SQLite output needs a file name')
+            return None
+        try:
+            return SqliteSink(filename, bufsize or SQLITE_BATCH)
+        except sqlite3.Error:
+            print('File open error: ' + filename)
+            return None
+    if filename == '-':
+        stream = sys.stdout.buffer
+    else:
+        try:
+            stream = open(filename, 'wb')
+        except:
+            print('File open error: ' + filename)
+            return None
+    sink = SINK_FORMATS[fmt](stream, bufsize or SINK_BUFFER)
+    sink.owned = filename != '-'
+    return sink
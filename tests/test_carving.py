@@ -0,0 +1,137 @@
+from struct import pack
+
+from logfile import CarvingProcess, LogfileParser, Operation, carving, carvingBlocks, checkLogBlock, liveSpans
+
+CLUSTER = 4096
+
+
+def insertHeader(tranid):
+    # INSERT_ROWS log record header: flag, fixed length, previous LSN, flag bits, transaction id, op
+    return pack('<BBH', 0, 0, 0x3E) + bytes(12) + tranid + bytes([2])
+
+
+def noise(size):
+    # no byte pair of a signature (flag byte followed by 0x00)
+    return (bytes(range(1, 251)) * (size // 250 + 1))[:size]
+
+
+def writeSparseImage(filename, hits):
+    with open(filename, 'wb') as f:
+        f.write(noise(0x10000))
+        f.seek(0x8000)
+        f.write(bytes(0x4000)) # zero-filled clusters
+        f.seek(0x80000) # hole up to here, and after the second extent
+        f.write(noise(0x10000))
+        f.truncate(0x100000)
+        for offset, tranid in hits:
+            f.seek(offset)
+            f.write(insertHeader(tranid))
+
+
+def test_live_spans():
+    buf = noise(CLUSTER) + bytes(CLUSTER * 2) + b'\xff' * CLUSTER + noise(CLUSTER * 2) + bytes(100)
+    assert liveSpans(buf, len(buf), CLUSTER) == [[0, CLUSTER], [CLUSTER * 4, CLUSTER * 6]]
+    buf = noise(CLUSTER) + noise(100)
+    assert liveSpans(buf, len(buf), CLUSTER) == [[0, CLUSTER + 100]]
+
+
+def test_hits_around_holes(tmp_path):
+    filename = str(tmp_path / 'sparse.img')
+    hits = [
+        (0x100, b'\x01' * 6),
+        (0x4000 - 8, b'\x02' * 6), # crosses the window edge
+        (0xC000 + 0x40, b'\x03' * 6), # right after the zero-filled clusters
+        (0x80000 + 0x800, b'\x04' * 6), # after the hole
+        (0x8FFD8, b'\x05' * 6), # just before the trailing hole
+    ]
+    writeSparseImage(filename, hits)
+    offsets, tranids, ops, skipped = carving(filename, 0, 0x100000 // CLUSTER, CLUSTER, windowsize=0x4000)
+    assert list(offsets) == [offset for offset, _ in hits]
+    assert tranids == b''.join(tranid for _, tranid in hits)
+    assert ops == bytes([2] * len(hits))
+    assert skipped == 0x100000 - 0x1C000 # holes and zero-filled clusters are not scanned
+
+    # a range starting inside the hole
+    offsets, _, _, _ = carving(filename, 0x40000 // CLUSTER, 0x100000 // CLUSTER, CLUSTER, windowsize=0x4000)
+    assert list(offsets) == [0x80800, 0x8FFD8]
+
+
+def beginRecord(tranid):
+    return pack('<BBH', 0, 0, 0x50) + bytes(12) + tranid + bytes([128, 0]) + bytes(0x38)
+
+
+def insertRecord(tranid, row):
+    # page id, slot id, partition id, one row log content
+    record = insertHeader(tranid) + b'\x00' + pack('<IHH', 60, 1, 3) + bytes(16) + pack('<QH', 0x1234, 0) + bytes(4) + bytes([1, 0])
+    return record + pack('<H', len(row)) + bytes(2) + row + bytes(-len(row) % 4)
+
+
+def logBlock(records, firstlsn=(5, 10, 1)):
+    # segment header, records from 0x48, slot array at the end of the segment; sector fixup applied
+    segsize = 0x48 + sum(len(x) for x in records) + len(records) * 2
+    length = segsize + (512 - segsize % 512) % 512
+    block = bytearray(length)
+    offsets = []
+    offset = 0x48
+    for record in records:
+        block[offset:offset + len(record)] = record
+        offsets.append(offset)
+        offset += len(record)
+    block[0] = 0x50
+    block[0x02:0x06] = pack('<HH', len(records), segsize)
+    block[0x0C:0x16] = pack('<iih', *firstlsn)
+    block[segsize - len(records) * 2:segsize] = pack('<' + str(len(records)) + 'H', *reversed(offsets))
+    for i in range(length // 512):
+        block[-(i + 1)] = block[i * 512]
+        block[i * 512] = 0x50 # sector parity
+    return bytes(block)
+
+
+def writeBlockImage(filename, blocks):
+    img = bytearray(0x10000)
+    for offset, block in blocks:
+        img[offset:offset + len(block)] = block
+    with open(filename, 'wb') as f:
+        f.write(img)
+
+
+def test_carve_log_blocks(tmp_path):
+    filename = str(tmp_path / 'blocks.img')
+    tranid = b'\x00\x00\x00\x00\x07\x01'
+    records = [beginRecord(tranid), insertRecord(tranid, b'row value'), insertRecord(tranid, b'second row' * 40)]
+    block = logBlock(records)
+    writeBlockImage(filename, [(0x2000, block), (0x8000, logBlock(records[:1]))])
+    assert checkLogBlock(LogfileParser._fixup(block, 512)) == True
+
+    offsets, lengths, _ = carvingBlocks(filename, 0, 0x10000 // CLUSTER, CLUSTER)
+    assert list(offsets) == [0x2000, 0x8000]
+    assert list(lengths) == [1024, 512]
+
+    cp = CarvingProcess(filename, CLUSTER)
+    cp.open()
+    cp._parseBlocks(offsets, lengths)
+    assert [x.op for x in cp.records] == [Operation.LOP_BEGIN_XACT, Operation.LOP_INSERT_ROWS, Operation.LOP_INSERT_ROWS, Operation.LOP_BEGIN_XACT]
+    assert [x.offset for x in cp.records] == [0x2048, 0x2048 + len(records[0]), 0x2048 + len(records[0]) + len(records[1]), 0x8048]
+    assert [x.rowlogcontent for x in cp.records[1:3]] == [[b'row value'], [b'second row' * 40]]
+    assert cp.records[1].partitionid == 0x1234 and cp.records[1].slotid == 3
+    assert all(x.transactionid == tranid and x.vlfseqnum == 5 for x in cp.records)
+
+
+def test_reject_corrupt_log_blocks(tmp_path):
+    filename = str(tmp_path / 'blocks.img')
+    tranid = b'\x00\x00\x00\x00\x07\x01'
+    records = [beginRecord(tranid), insertRecord(tranid, b'row value')]
+    badop = bytearray(records[1])
+    badop[0x16] = 0xFE
+    block = logBlock(records)
+    slots = 0x48 + len(records[0]) + len(records[1])
+    corrupt = [
+        logBlock(records, firstlsn=(0, 10, 1)), # no VLF sequence number
+        logBlock([records[0], bytes(badop)]), # unknown op
+        block[:slots] + bytes(4) + block[slots + 4:], # slot array overwritten
+    ]
+    for candidate in corrupt:
+        assert checkLogBlock(LogfileParser._fixup(candidate, 512)) == False
+    writeBlockImage(filename, [(0x1000 * (i + 1), x) for i, x in enumerate(corrupt)])
+    offsets, lengths, _ = carvingBlocks(filename, 0, 0x10000 // CLUSTER, CLUSTER)
+    assert list(offsets) == []
@@ -0,0 +1,224 @@
+from struct import pack
+
+import datafile
+from datafile import Datafile, DatafileParser, RowInfo, SchemeInfo
+
+PAGESIZE = 8192
+PARTITIONID = 0x1234
+ALLOCUNITID = 100 << 16
+
+
+def pageHeader(img, page, type, objectid, numofslot=0):
+    base = page * PAGESIZE
+    img[base] = 1
+    img[base + 1] = type
+    img[base + 0x16:base + 0x18] = pack('<H', numofslot)
+    img[base + 0x18:base + 0x1C] = pack('<I', objectid)
+
+
+def pageRows(img, page, rows):
+    offset = 96
+    for i, row in enumerate(rows):
+        img[page * PAGESIZE + offset:page * PAGESIZE + offset + len(row)] = row
+        img[(page + 1) * PAGESIZE - 2 * (i + 1):(page + 1) * PAGESIZE - 2 * i] = pack('<H', offset)
+        offset += len(row)
+
+
+def dataRow(key, value, numofcol=3, nullbitmap=0):
+    # flag bit, id int (clustered key), val int
+    return bytes([0x10, 0, 13, 0, 1]) + pack('<ii', key, value) + pack('<H', numofcol) + bytes([nullbitmap])
+
+
+def makeImage(filename, page61):
+    img = bytearray(PAGESIZE * 70)
+    # boot page: first sysallocunits page
+    img[9 * PAGESIZE + 0x60 + 0x264:9 * PAGESIZE + 0x60 + 0x264 + 6] = pack('<IH', 20, 1)
+    allocunit = b'\x10\x00\x30\x00' + pack('<QBQIH', ALLOCUNITID, 1, PARTITIONID, 0, 1) + pack('<IH', 60, 1) + pack('<IH', 50, 1) + pack('<IH', 0, 1)
+    pageHeader(img, 20, 1, 7, 1)
+    pageRows(img, 20, [allocunit])
+    # clustered index root over two data pages
+    pageHeader(img, 50, 2, ALLOCUNITID >> 16, 2)
+    pageRows(img, 50, [b'\x06' + pack('<i', 0) + pack('<IH', 60, 1), b'\x06' + pack('<i', 100) + pack('<IH', 61, 1)])
+    pageHeader(img, 60, 1, ALLOCUNITID >> 16, 50)
+    pageRows(img, 60, [dataRow(i, i * 10) for i in range(1, 51)])
+    pageHeader(img, 61, 1, ALLOCUNITID >> 16, len(page61))
+    pageRows(img, 61, page61)
+    with open(filename, 'wb') as f:
+        f.write(img)
+
+
+def tableScheme():
+    scheme = []
+    for colorder, (colname, datatype, colsize) in enumerate([('flag', 'bit', 1), ('id', 'int', 4), ('val', 'int', 4)], 1):
+        schema = SchemeInfo()
+        schema.tobjectid = 100
+        schema.colorder = colorder
+        schema.colname = colname
+        schema.datatype = datatype
+        schema.colsize = colsize
+        scheme.append(schema)
+    return scheme
+
+
+def openParser(filename):
+    datafile = Datafile()
+    datafile.open(filename)
+    parser = DatafileParser(datafile)
+    parser.keycolumnsmap[100] = [2]
+    scheme = tableScheme()
+    rowinfo = RowInfo()
+    for schema in scheme:
+        parser._tableSchemeAnalyzer(schema, rowinfo)
+    return parser, scheme
+
+
+def test_seek_clustered_key(tmp_path):
+    filename = str(tmp_path / 'seek.mdf')
+    makeImage(filename, [dataRow(i, i * 10) for i in range(100, 151)])
+    parser, scheme = openParser(filename)
+    layout = parser.getKeyLayout(100, scheme)
+    assert layout.numoftotalcol == 3 and layout.fixedend == 13
+    assert [(x.colorder, x.rowoffset) for x in layout.columns] == [(2, 5)]
+
+    found = parser.seekClusteredKey(PARTITIONID, layout, (103,))
+    assert found is not None
+    pagenumber, buf, offset = found
+    assert pagenumber == 61
+    assert buf[offset + 5:offset + 13] == pack('<ii', 103, 1030)
+    assert parser.seekClusteredKey(PARTITIONID, layout, (99,)) is None
+
+
+def test_row_key_checks_record_layout(tmp_path):
+    filename = str(tmp_path / 'seek.mdf')
+    makeImage(filename, [dataRow(i, i * 10) for i in range(100, 151)])
+    parser, scheme = openParser(filename)
+    layout = parser.getKeyLayout(100, scheme)
+    assert parser.rowKey(dataRow(101, 1010), 0, layout) == (101,)
+    assert parser.rowKey(dataRow(101, 1010, numofcol=4), 0, layout) is None # column count of another layout
+    assert parser.rowKey(dataRow(101, 1010, nullbitmap=0x02), 0, layout) is None # NULL key column
+    assert parser.rowKey(dataRow(101, 1010, nullbitmap=0x04), 0, layout) == (101,)
+    assert parser.rowKey(b'\x14' + dataRow(101, 1010)[1:], 0, layout) is None # forwarding stub
+
+
+def test_failed_root_lookup_keeps_allocation_units(tmp_path):
+    filename = str(tmp_path / 'empty.mdf')
+    with open(filename, 'wb') as f:
+        f.write(bytes(PAGESIZE * 16))
+    parser, scheme = openParser(filename)
+    assert parser.getRootPage(PARTITIONID) == (0, 0)
+    assert parser.rootlookupfailed
+    assert len(parser.allocunits) == 0
+
+
+def makeCatalogImage(filename, systemobjects, gamfree=()):
+    img = bytearray(PAGESIZE * 80)
+    img[9 * PAGESIZE + 0x60 + 0x264:9 * PAGESIZE + 0x60 + 0x264 + 6] = pack('<IH', 20, 1)
+    allocunits = []
+    for i, objectid in enumerate(systemobjects):
+        iampage, datapage = 30 + i, 40 + i
+        allocunits.append(b'\x10\x00\x30\x00' + pack('<QBQIH', objectid << 16, 1, objectid << 16, 0, 1) + pack('<IH', datapage, 1) + pack('<IH', datapage, 1) + pack('<IH', iampage, 1))
+        # IAM page: one single page allocation, plus extents 6 and 7 for the first object
+        pageHeader(img, iampage, 10, objectid)
+        img[iampage * PAGESIZE + 0x8E:iampage * PAGESIZE + 0x94] = pack('<IH', datapage, 1)
+        if i == 0:
+            img[iampage * PAGESIZE + 0xC2] = 0xC0
+        pageHeader(img, datapage, 1, objectid)
+    pageHeader(img, 20, 1, 7, len(allocunits))
+    pageRows(img, 20, allocunits)
+    pageHeader(img, 48, 1, systemobjects[0])
+    pageHeader(img, 49, 2, systemobjects[0]) # index page, not mapped
+    pageHeader(img, 56, 1, systemobjects[0])
+    pageHeader(img, 2, 8, 0)
+    for extent in gamfree:
+        img[2 * PAGESIZE + 0xC2 + extent // 8] |= 1 << (extent % 8)
+    with open(filename, 'wb') as f:
+        f.write(img)
+
+
+def scanAllocation(filename):
+    datafile = Datafile()
+    datafile.open(filename)
+    parser = DatafileParser(datafile)
+    return parser.scanAllocationPages(), dict(parser.pages)
+
+
+def test_allocation_pages(tmp_path):
+    filename = str(tmp_path / 'iam.mdf')
+    makeCatalogImage(filename, [0x05, 0x07, 0x22, 0x29, 0x37])
+    found, pages = scanAllocation(filename)
+    assert found == True
+    assert pages == {40: 0x05, 41: 0x07, 42: 0x22, 43: 0x29, 44: 0x37, 48: 0x05, 56: 0x05}
+
+
+def test_allocation_pages_skip_free_extents(tmp_path):
+    filename = str(tmp_path / 'iam.mdf')
+    makeCatalogImage(filename, [0x05, 0x07, 0x22, 0x29, 0x37], gamfree=[7])
+    found, pages = scanAllocation(filename)
+    assert found == True
+    assert 48 in pages and 56 not in pages
+
+
+def test_allocation_pages_missing_catalog(tmp_path):
+    filename = str(tmp_path / 'iam.mdf')
+    makeCatalogImage(filename, [0x05, 0x07, 0x22, 0x37]) # no sysrowsets IAM chain
+    found, pages = scanAllocation(filename)
+    assert found == False
+    assert 0x29 not in pages.values()
+
+
+def writeDataFile(filename, fileid, numofpages=8):
+    img = bytearray(PAGESIZE * numofpages)
+    for page in range(numofpages):
+        pageHeader(img, page, 1, 100)
+        img[page * PAGESIZE + 0x20:page * PAGESIZE + 0x26] = pack('<IH', page, fileid)
+        img[page * PAGESIZE + 0x60] = fileid * 16 + page # marker of the file and page it was read from
+    with open(filename, 'wb') as f:
+        f.write(img)
+
+
+def openFiles(tmp_path, fileids):
+    filenames = []
+    for fileid in fileids:
+        filenames.append(str(tmp_path / ('data{}.ndf' if filenames else 'data{}.mdf').format(len(filenames))))
+        writeDataFile(filenames[-1], fileid)
+    datafile = Datafile()
+    datafile.open(filenames[0])
+    return DatafileParser(datafile), filenames
+
+
+def test_read_pages_by_file_id(tmp_path):
+    parser, filenames = openFiles(tmp_path, [1, 3])
+    assert parser.mssql.fileid == 1
+    assert parser.files.add(filenames[1]) == True
+    assert parser.files.filepaths == {1: filenames[0], 3: filenames[1]}
+
+    pages = parser.readPages([(3, 5), (1, 2), (3, 0), (1, 7), (2, 1)])
+    assert [(k, v[0][0x60]) for k, v in sorted(pages.items()) if v[0] is not None] == [((1, 2), 0x12), ((1, 7), 0x17), ((3, 0), 0x30), ((3, 5), 0x35)]
+    assert pages[(3, 5)][1].fileid == 3 and pages[(3, 5)][1].pageid == 5
+    assert pages[(2, 1)] == (None, None) # no such file
+
+    # the same pages read one file after the other
+    parser.files.primary.parallel = False
+    assert {k: v[0] for k, v in parser.readPages([(3, 5), (1, 2)]).items()} == {k: pages[k][0] for k in [(3, 5), (1, 2)]}
+    parser.files.close()
+
+
+def test_reject_invalid_file_id(tmp_path):
+    parser, filenames = openFiles(tmp_path, [1, 3, 3, 1, 0])
+    assert parser.files.add(filenames[1]) == True
+    for filename in filenames[2:]: # duplicate id, the primary's id, no file id
+        assert parser.files.add(filename) == False
+    assert parser.files.filepaths == {1: filenames[0], 3: filenames[1]}
+    parser.files.close()
+
+
+def test_reopen_closed_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(datafile, 'MAX_OPEN_FILES', 1)
+    parser, filenames = openFiles(tmp_path, [1, 3, 4])
+    assert parser.files.add(filenames[1]) == True
+    assert parser.files.add(filenames[2]) == True # closes file 3
+    assert list(parser.files.handles) == [4]
+    pages = parser.readPages([(3, 1), (4, 1), (1, 1)])
+    assert sorted((k, v[0][0x60]) for k, v in pages.items()) == [((1, 1), 0x11), ((3, 1), 0x31), ((4, 1), 0x41)]
+    assert len(parser.files.handles) == 1
+    parser.files.close()
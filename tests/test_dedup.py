@@ -0,0 +1,46 @@
+from logfile import CarvingProcess, LogRecordInfo, Operation
+
+
+def makeRecord(offset, contents, slotnum=0, txid=1, begintime=''):
+    record = LogRecordInfo()
+    record.op = Operation.LOP_INSERT_ROWS
+    record.offset = offset
+    record.slotnum = slotnum
+    record.transactionid = bytes([0, 0, 0, 0, 0, txid])
+    record.previousLSN = (0x20, 0x100, 1)
+    record.rowlogcontent = list(contents)
+    record.begintime = begintime
+    return record
+
+
+def dedup(records):
+    cp = CarvingProcess('image', 4096)
+    cp.records = list(records)
+    for record in records:
+        cp.transactions[record.transactionid].append(record)
+    cp.dedup()
+    return cp
+
+
+def test_keeps_best_copy():
+    carved = makeRecord(0x9000, [b'row'])
+    fromblock = makeRecord(0x20000, [b'row'], slotnum=3) # parsed from an intact log block
+    earlier = makeRecord(0x1000, [b'row'])
+    other = makeRecord(0x5000, [b'other'])
+    cp = dedup([carved, fromblock, earlier, other])
+    assert cp.duplicates == 2
+    assert cp.records == [other, fromblock]
+    assert cp.transactions[carved.transactionid] == [other, fromblock]
+
+
+def test_lower_offset_breaks_ties():
+    first, second = makeRecord(0x3000, [b'row']), makeRecord(0x1000, [b'row'])
+    cp = dedup([first, second])
+    assert cp.records == [second]
+
+
+def test_distinct_records_are_kept():
+    records = [makeRecord(0x1000, [b'row']), makeRecord(0x2000, [b'row'], txid=2), makeRecord(0x3000, [b'ro', b'w'])]
+    cp = dedup(records)
+    assert cp.duplicates == 0
+    assert cp.records == records
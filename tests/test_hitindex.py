@@ -0,0 +1,59 @@
+from array import array
+
+from hitindex import HitIndex
+
+
+def makeResults():
+    # per carving range: ascending offsets, 6-byte transaction ids, op codes; ranges come back in any order
+    return [
+        (array('Q', [0x10000, 0x10040]), bytes(range(12)), bytes([2, 4])),
+        (array('Q'), b'', b''),
+        (array('Q', [0x40, 0x1F00, 0x8000]), bytes(range(100, 118)), bytes([128, 3, 129])),
+    ]
+
+
+def test_merge_orders_ranges():
+    hits = HitIndex()
+    hits.merge(makeResults())
+    assert list(hits.offsets) == [0x40, 0x1F00, 0x8000, 0x10000, 0x10040]
+    assert bytes(hits.ops) == bytes([128, 3, 129, 2, 4])
+    assert hits.getTranid(0) == bytes(range(100, 106))
+    assert hits.getTranid(4) == bytes(range(6, 12))
+
+
+def test_round_trip(tmp_path):
+    filename = str(tmp_path / 'hits.idx')
+    hits = HitIndex()
+    hits.merge(makeResults())
+    hits.write(filename)
+
+    loaded = HitIndex()
+    assert loaded.load(filename) == True
+    assert len(loaded) == len(hits) == 5
+    assert list(loaded.offsets) == list(hits.offsets)
+    assert bytes(loaded.ops) == bytes(hits.ops)
+    assert [loaded.getTranid(i) for i in range(len(loaded))] == [hits.getTranid(i) for i in range(len(hits))]
+    loaded.close()
+    assert len(loaded) == 0
+
+
+def test_empty_round_trip(tmp_path):
+    filename = str(tmp_path / 'empty.idx')
+    HitIndex().write(filename)
+    loaded = HitIndex()
+    assert loaded.load(filename) == True
+    assert len(loaded) == 0
+    loaded.close()
+
+
+def test_invalid_index(tmp_path):
+    filename = str(tmp_path / 'bad.idx')
+    hits = HitIndex()
+    hits.merge(makeResults())
+    hits.write(filename)
+    with open(filename, 'r+b') as f:
+        f.truncate(f.seek(0, 2) - 1)
+    assert HitIndex().load(filename) == False
+    with open(filename, 'wb') as f:
+        f.write(b'NOTAHITS' + bytes(8))
+    assert HitIndex().load(filename) == False
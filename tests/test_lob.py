@@ -0,0 +1,128 @@
+from struct import pack
+
+from datafile import Datafile, DatafileParser, LobReader, SchemeInfo
+from logfile import LogfileParser
+
+PAGESIZE = 8192
+
+
+def lobRecord(lobtype, body):
+    # status (2 bytes), length, blob id (8 bytes), type, type dependent part
+    record = pack('<H', 8) + b'\x00\x00' + pack('<QH', 1, lobtype) + body
+    return record[:2] + pack('<H', len(record)) + record[4:]
+
+
+def dataRecord(data):
+    return lobRecord(3, data)
+
+
+def smallRoot(data):
+    return lobRecord(0, pack('<H', len(data)) + bytes(4) + data)
+
+
+def largeRoot(links):
+    # max links, current links, level, unused, then (size, page, file, slot) links
+    return lobRecord(5, pack('<HHH', len(links), len(links), 1) + bytes(4) + b''.join(pack('<IIHH', *x) for x in links))
+
+
+def internal(links):
+    # max links, current links, level, then (end offset, page, file, slot) links
+    return lobRecord(2, pack('<HHH', len(links), len(links), 0) + b''.join(pack('<QIHH', *x) for x in links))
+
+
+def writePages(filename, pages, slotoffsets=None):
+    img = bytearray(PAGESIZE * 40)
+    for page, records in pages.items():
+        base = page * PAGESIZE
+        img[base + 1] = 3 # text page
+        img[base + 0x16:base + 0x18] = pack('<H', len(records))
+        offset = 0x60
+        for i, record in enumerate(records):
+            img[base + offset:base + offset + len(record)] = record
+            img[base + PAGESIZE - 2 * (i + 1):base + PAGESIZE - 2 * i] = pack('<H', offset)
+            offset += len(record)
+    for (page, slot), offset in (slotoffsets or {}).items():
+        img[(page + 1) * PAGESIZE - 2 * (slot + 1):(page + 1) * PAGESIZE - 2 * slot] = pack('<H', offset)
+    with open(filename, 'wb') as f:
+        f.write(img)
+
+
+def openReader(filename):
+    datafile = Datafile()
+    datafile.open(filename)
+    return LobReader(DatafileParser(datafile))
+
+
+def inRowPointer(pointertype, links):
+    # 12 bytes header, then (end offset, page, file, slot) entries
+    return bytes([pointertype]) + bytes(11) + b''.join(pack('<IIHH', *x) for x in links)
+
+
+def textPointer(page, slot):
+    return bytes(8) + pack('<IHH', page, 1, slot)
+
+
+def readValue(reader, pointer):
+    return b''.join(reader.iterChunks(pointer))
+
+
+def test_row_overflow_pointer(tmp_path):
+    filename = str(tmp_path / 'lob.mdf')
+    writePages(filename, {30: [dataRecord(b'overflow value')]})
+    reader = openReader(filename)
+    assert readValue(reader, inRowPointer(2, [(14, 30, 1, 0)])) == b'overflow value'
+
+
+def test_inline_root(tmp_path):
+    filename = str(tmp_path / 'lob.mdf')
+    writePages(filename, {30: [dataRecord(b'hello '), dataRecord(b'unused')], 31: [dataRecord(b'world and more')]})
+    reader = openReader(filename)
+    # the end offsets cut each data record to its share of the value
+    assert readValue(reader, inRowPointer(4, [(6, 30, 1, 0), (11, 31, 1, 0)])) == b'hello world'
+
+
+def test_multi_level_tree(tmp_path):
+    filename = str(tmp_path / 'lob.mdf')
+    writePages(filename, {
+        30: [largeRoot([(7, 31, 1, 0), (5, 31, 1, 1)])],
+        31: [internal([(3, 32, 1, 0), (7, 32, 1, 1)]), internal([(5, 33, 1, 0)])],
+        32: [dataRecord(b'abc'), dataRecord(b'defg')],
+        33: [dataRecord(b'hijkl')],
+    })
+    reader = openReader(filename)
+    assert readValue(reader, textPointer(30, 0)) == b'abcdefghijkl'
+
+    # decoded through a parser, as recovery does for varchar(max) columns
+    parser = LogfileParser(None, reader.mdf)
+    schema = SchemeInfo()
+    schema.datatype = 'varchar'
+    assert parser._decodeValue(textPointer(30, 0), 0, schema, 0, True) == "'abcdefghijkl'"
+
+
+def test_small_root(tmp_path):
+    filename = str(tmp_path / 'lob.mdf')
+    writePages(filename, {30: [smallRoot(b'small')]})
+    reader = openReader(filename)
+    assert readValue(reader, textPointer(30, 0)) == b'small'
+
+
+def test_corrupt_or_reused_pages(tmp_path):
+    filename = str(tmp_path / 'lob.mdf')
+    writePages(filename, {
+        30: [dataRecord(b'ok')],
+        31: [lobRecord(0, b''), lobRecord(5, bytes(4)), lobRecord(2, bytes(2))], # records cut short for their type
+        32: [b'\xff' * 40], # reused for other data
+    }, slotoffsets={(30, 0): PAGESIZE - 1})
+    reader = openReader(filename)
+    assert readValue(reader, textPointer(30, 0)) == b'' # slot offset at the end of the page
+    assert readValue(reader, textPointer(30, 5)) == b'' # slot past the slot count
+    for slot in range(3):
+        assert readValue(reader, textPointer(31, slot)) == b''
+    assert readValue(reader, textPointer(32, 0)) == b''
+    assert readValue(reader, textPointer(39, 0)) == b'' # empty page
+    assert readValue(reader, inRowPointer(2, [(2, 1000, 1, 0)])) == b'' # page past the end of the file
+
+    parser = LogfileParser(None, reader.mdf)
+    schema = SchemeInfo()
+    schema.datatype = 'nvarchar'
+    assert parser._decodeValue(textPointer(31, 0), 0, schema, 0, True) == ''
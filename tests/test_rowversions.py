@@ -0,0 +1,85 @@
+from struct import pack
+
+from logfile import LogRecordInfo, Operation, RowVersions
+
+PAGEID = pack('<IH', 60, 1)
+
+
+def dataRow(key, value):
+    return bytes([0x10, 0, 12, 0]) + pack('<ii', key, value) + pack('<H', 2) + b'\x00'
+
+
+def makeRecord(op, slotnum, contents, slotid=3, offsetinrow=8):
+    record = LogRecordInfo()
+    record.op = op
+    record.slotnum = slotnum
+    record.pageid = PAGEID
+    record.slotid = slotid
+    record.offsetinrow = offsetinrow
+    record.rowlogcontent = list(contents)
+    return record
+
+
+def modify(slotnum, before, after, slotid=3):
+    # value column (offset 8) changed from before to after
+    return makeRecord(Operation.LOP_MODIFY_ROW, slotnum, [pack('<i', before), pack('<i', after)], slotid)
+
+
+def test_forward_from_insert():
+    versions = RowVersions()
+    insert = makeRecord(Operation.LOP_INSERT_ROWS, 1, [dataRow(7, 10)])
+    first, second = modify(2, 10, 11), modify(3, 11, 12)
+    for record in (insert, first, second):
+        versions.apply(record)
+    assert first.rowimages == [dataRow(7, 11), dataRow(7, 10)]
+    assert second.rowimages == [dataRow(7, 12), dataRow(7, 11)]
+    assert versions.images[RowVersions.key(insert)] == dataRow(7, 12)
+    assert len(versions.pending) == 0
+
+
+def test_backward_from_delete():
+    versions = RowVersions()
+    first, second = modify(1, 10, 11), modify(2, 11, 12)
+    delete = makeRecord(Operation.LOP_DELETE_ROWS, 3, [dataRow(7, 12)])
+    for record in (first, second, delete):
+        versions.apply(record)
+    assert first.rowimages == [dataRow(7, 11), dataRow(7, 10)]
+    assert second.rowimages == [dataRow(7, 12), dataRow(7, 11)]
+    assert len(versions.pending) == 0
+    assert RowVersions.key(delete) not in versions.images
+
+
+def test_gap_is_left_pending():
+    versions = RowVersions()
+    insert = makeRecord(Operation.LOP_INSERT_ROWS, 1, [dataRow(7, 10)])
+    missing = modify(3, 20, 21) # the record changing 10 to 20 was not recovered
+    later = modify(4, 21, 22)
+    other = modify(5, 5, 6, slotid=4) # another row of the page
+    for record in (insert, missing, later, other):
+        versions.apply(record)
+    assert missing.rowimages == [] and later.rowimages == [] and other.rowimages == []
+    assert versions.pending[(PAGEID, 3)] == [missing, later]
+    assert versions.pending[(PAGEID, 4)] == [other]
+
+    # resolved from the current row, as read from the MDF
+    RowVersions.chainBackward(versions.pending[(PAGEID, 3)], dataRow(7, 22))
+    assert later.rowimages == [dataRow(7, 22), dataRow(7, 21)]
+    assert missing.rowimages == [dataRow(7, 21), dataRow(7, 20)]
+
+
+def test_chain_backward_stops_at_mismatch():
+    first, second = modify(1, 10, 11), modify(2, 11, 12)
+    RowVersions.chainBackward([first, second], dataRow(7, 13)) # the row changed again after second
+    assert first.rowimages == [] and second.rowimages == []
+
+
+def test_reinsert_drops_pending_updates():
+    versions = RowVersions()
+    orphan = modify(1, 10, 11)
+    insert = makeRecord(Operation.LOP_INSERT_ROWS, 2, [dataRow(8, 30)])
+    update = modify(3, 30, 31)
+    for record in (orphan, insert, update):
+        versions.apply(record)
+    assert (PAGEID, 3) not in versions.pending
+    assert orphan.rowimages == []
+    assert update.rowimages == [dataRow(8, 31), dataRow(8, 30)]
@@ -0,0 +1,61 @@
+import random
+from struct import pack
+
+import pytest
+
+import logfile
+from logfile import _scanSigRegex, scanSig
+
+
+def scanSigLoop(buf, size):
+    # byte loop the vectorized scanner replaced
+    sig1 = [b'\x00\x00\x3E\x00', b'\x40\x00\x3E\x00', b'\x48\x00\x3E\x00', b'\x80\x00\x3E\x00', b'\x88\x00\x3E\x00']
+    sig2 = [b'\x00\x00\x4C\x00', b'\x40\x00\x4C\x00', b'\x48\x00\x4C\x00', b'\x80\x00\x4C\x00', b'\x88\x00\x4C\x00']
+    sig3 = [b'\x00\x00\x50\x00', b'\x40\x00\x50\x00', b'\x48\x00\x50\x00', b'\x80\x00\x50\x00', b'\x88\x00\x50\x00']
+    offset = 0
+    offsetList = []
+    while offset + 0x16 < size:
+        if buf[offset:offset + 0x04] in sig1 and buf[offset + 0x16] in [2, 3, 4]:
+            offsetList.append([offset, buf[offset + 0x10:offset + 0x16]])
+        elif buf[offset:offset + 0x04] in sig2 and buf[offset + 0x16] == 128:
+            offsetList.append([offset, buf[offset + 0x10:offset + 0x16]])
+        elif buf[offset:offset + 0x04] in sig3 and buf[offset + 0x16] == 129:
+            offsetList.append([offset, buf[offset + 0x10:offset + 0x16]])
+        offset += 4
+    return offsetList
+
+
+def makeImage(seed, size=1 << 16):
+    rand = random.Random(seed)
+    # noise biased towards the signature bytes, so near misses are common
+    image = bytearray(rand.choice((0x00, 0x3E, 0x40, 0x48, 0x4C, 0x50, 0x80, 0x88, 0x02, 0x81, rand.randrange(256))) for _ in range(size))
+    for _ in range(300):
+        flag = rand.choice((0x00, 0x40, 0x48, 0x80, 0x88, 0x08))
+        fixedlength, op = rand.choice(((0x3E, 2), (0x3E, 3), (0x3E, 4), (0x3E, 5), (0x4C, 128), (0x50, 129), (0x4C, 129)))
+        offset = rand.randrange(0, size - 4) & ~rand.choice((0, 3)) # mostly 4-byte aligned
+        header = pack('<BBH', flag, 0, fixedlength) + bytes(rand.randrange(256) for _ in range(0x12)) + bytes([op])
+        header = header[:size - offset]
+        image[offset:offset + len(header)] = header
+    return bytes(image)
+
+
+def normalize(offsetList):
+    return [(offset, bytes(tranid)) for offset, tranid in offsetList]
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_scanners_match_byte_loop(seed):
+    image = makeImage(seed)
+    expected = normalize(scanSigLoop(image, len(image)))
+    assert len(expected) > 50
+    assert normalize(_scanSigRegex(image, len(image))) == expected
+    if logfile.np is not None:
+        assert normalize(scanSig(image, len(image))) == expected
+
+
+@pytest.mark.parametrize('size', [0, 0x16, 0x17, 0x1A, 0x1B, 0x100, 0xFFFD])
+def test_scanners_match_byte_loop_with_short_size(size):
+    image = makeImage(9)
+    expected = normalize(scanSigLoop(image, size))
+    assert normalize(_scanSigRegex(image, size)) == expected
+    assert normalize(scanSig(image, size)) == expected
@@ -0,0 +1,92 @@
+import csv
+import json
+import sqlite3
+
+from logfile import LogRecordInfo, Operation
+from sink import CsvSink, SqliteSink, openSink
+
+QUERY = 'insert into [t é] values (\'a, "b"\nc\', N\'한글\')' # commas, quotes, a newline and non-ASCII text
+
+
+def makeRecord(txid, slotnum, op=Operation.LOP_INSERT_ROWS, contents=()):
+    record = LogRecordInfo()
+    record.op = op
+    record.transactionid = bytes([0, 0, 0, 0, 0, txid])
+    record.vlfseqnum = 0x20
+    record.blocknum = 0x100
+    record.slotnum = slotnum
+    record.offset = slotnum * 0x40
+    record.rowlogcontent = list(contents)
+    return record
+
+
+def writeSample(filename):
+    sink = SqliteSink(filename, bufsize=2)
+    sink.writeStatement('01/02/2024 10:00:00.000', '01/02/2024 10:00:01.000', makeRecord(1, 1), 't', "insert into [t] values ('1')")
+    sink.writeStatement('01/02/2024 10:00:00.000', '01/02/2024 10:00:01.000', makeRecord(1, 2), 't', "insert into [t] values ('2')")
+    sink.writeRaw('', '', makeRecord(2, 3, Operation.LOP_MODIFY_ROW, [b'\x01\x02', b'\x03']), 't')
+    sink.close()
+
+
+def test_sqlite_round_trip(tmp_path):
+    filename = str(tmp_path / 'out.sqlite')
+    writeSample(filename)
+
+    conn = sqlite3.connect(filename)
+    statements = conn.execute('SELECT tablename, begintime, txid, op, lsn, query FROM statements ORDER BY lsn').fetchall()
+    assert statements == [
+        ('t', '2024-01-02 10:00:00.000', '000000000001', 'LOP_INSERT_ROWS', '00000020:00000100:0001', "insert into [t] values ('1')"),
+        ('t', '2024-01-02 10:00:00.000', '000000000001', 'LOP_INSERT_ROWS', '00000020:00000100:0002', "insert into [t] values ('2')"),
+    ]
+    raws = conn.execute('SELECT rawid, txid, op, begintime FROM raws').fetchall()
+    assert raws == [(1, '000000000002', 'LOP_MODIFY_ROW', None)]
+    assert conn.execute('SELECT idx, content FROM rowlogcontents WHERE rawid = 1 ORDER BY idx').fetchall() == [(0, b'\x01\x02'), (1, b'\x03')]
+    assert conn.execute('SELECT txid, statements, raws FROM transactions ORDER BY txid').fetchall() == [('000000000001', 2, 0), ('000000000002', 0, 1)]
+    conn.close()
+
+
+def test_sqlite_rerun_replaces_output(tmp_path):
+    filename = str(tmp_path / 'out.sqlite')
+    writeSample(filename)
+    writeSample(filename)
+
+    conn = sqlite3.connect(filename)
+    assert conn.execute('SELECT count(*) FROM statements').fetchone()[0] == 2
+    assert conn.execute('SELECT count(*) FROM raws').fetchone()[0] == 1
+    assert conn.execute('SELECT count(*) FROM rowlogcontents').fetchone()[0] == 2
+    assert conn.execute('SELECT statements, raws FROM transactions WHERE txid = ?', ('000000000001',)).fetchone() == (2, 0)
+    conn.close()
+
+
+def writeText(filename, fmt):
+    sink = openSink(filename, fmt, bufsize=2)
+    sink.writeStatement('01/02/2024 10:00:00.000', '', makeRecord(1, 1), 't é', QUERY)
+    sink.writeRaw('', '', makeRecord(2, 2, Operation.LOP_MODIFY_ROW, [b'\x01\x02', b'\x03']), 't')
+    sink.writeStatement('', '', makeRecord(1, 3), 't', "delete from [t] where id = ''")
+    sink.close()
+
+
+def test_csv_round_trip(tmp_path):
+    filename = str(tmp_path / 'out.csv')
+    writeText(filename, 'csv')
+    with open(filename, 'r', encoding='utf-8', newline='') as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == CsvSink.header
+    assert rows[1] == ['statement', '01/02/2024 10:00:00.000', '', 'LOP_INSERT_ROWS', 't é', '000000000001', '00000020:00000100:0001', '64', QUERY, '']
+    assert rows[2] == ['raw', '', '', 'LOP_MODIFY_ROW', 't', '000000000002', '00000020:00000100:0002', '128', '', '0102 03']
+    assert rows[3][8] == "delete from [t] where id = ''"
+    assert len(rows) == 4
+
+
+def test_jsonl_round_trip(tmp_path):
+    filename = str(tmp_path / 'out.jsonl')
+    writeText(filename, 'jsonl')
+    with open(filename, 'rb') as f:
+        lines = f.read().decode('utf8').splitlines()
+    assert len(lines) == 3
+    rows = [json.loads(x) for x in lines]
+    assert rows[0] == {'type': 'statement', 'begintime': '01/02/2024 10:00:00.000', 'endtime': '', 'op': 'LOP_INSERT_ROWS', 'table': 't é',
+                       'transactionid': '000000000001', 'lsn': '00000020:00000100:0001', 'offset': 64, 'query': QUERY, 'rowlogcontent': None}
+    assert rows[1]['query'] is None and rows[1]['rowlogcontent'] == ['0102', '03']
+    assert rows[2]['query'] == "delete from [t] where id = ''"
+    assert '한글' in lines[0] # written as UTF-8, not escaped
@@ -0,0 +1,61 @@
+from datafile import SchemeInfo
+from logfile import StatementTemplate
+
+
+def tableScheme(*colnames):
+    scheme = []
+    for colorder, colname in enumerate(colnames, 1):
+        schema = SchemeInfo()
+        schema.colorder = colorder
+        schema.colname = colname
+        scheme.append(schema)
+    return scheme
+
+
+def test_render_all_columns():
+    template = StatementTemplate('t', tableScheme('id', 'name', 'qty'))
+    assert template.renderInsert(["'1'", "'a{b}'", "'3'"]) == "insert into [t] values ('1','a{b}','3')"
+    assert template.renderDelete(["'1'", "'a'", "'3'"]) == "delete from [t] where [id]='1' and [name]='a' and [qty]='3'"
+    assert template.renderUpdate(["'1'", "'b'", "'3'"], ["'1'", "'a'", "'3'"]) == \
+        "update [t] set [id]='1', [name]='b', [qty]='3' where [id]='1' and [name]='a' and [qty]='3'"
+    assert template.renderInsert(["'1'", "'a'"]) == False
+
+
+def test_render_quoted_names():
+    template = StatementTemplate('a]b', tableScheme('c{0}'))
+    assert template.renderInsert(["'1'"]) == "insert into [a]]b] values ('1')"
+    assert template.renderDelete(["'1'"]) == "delete from [a]]b] where [c{0}]='1'"
+
+
+def test_render_projection():
+    template = StatementTemplate('t', tableScheme('id', 'name', 'qty'), keycolumns=[1], columns=['qty'])
+    assert template.decode == [True, False, True]
+    assert template.renderInsert(["'1'", '', "'3'"]) == "insert into [t] ([id],[qty]) values ('1','3')"
+    assert template.renderDelete(["'1'", '', "'3'"]) == "delete from [t] where [id]='1' and [qty]='3'"
+    # the key column is decoded for the WHERE, not set
+    assert template.renderUpdate(["'1'", '', "'4'"], ["'1'", '', "'3'"]) == "update [t] set [qty]='4' where [id]='1' and [qty]='3'"
+
+
+def test_render_projection_without_known_columns():
+    template = StatementTemplate('t', tableScheme('id', 'name'), columns=['missing'])
+    assert template.decode is None
+    assert template.renderInsert(["'1'", "'a'"]) == "insert into [t] values ('1','a')"
+    assert template.renderUpdate(["'1'", "'b'"], ["'1'", "'a'"]) == "update [t] set [id]='1', [name]='b' where [id]='1' and [name]='a'"
+
+
+def test_render_key_only():
+    template = StatementTemplate('t', tableScheme('id', 'name', 'qty'), keycolumns=[1], keyonly=True)
+    assert template.renderDelete(["'1'", "'a'", "'3'"]) == "delete from [t] where [id]='1'"
+    assert template.renderUpdate(["'1'", "'b'", "'3'"], ["'1'", "'a'", "'3'"]) == "update [t] set [name]='b' where [id]='1'"
+    assert template.renderUpdate(["'1'", "'a'", "'3'"], ["'1'", "'a'", "'3'"]) == "update [t] set [id]='1', [name]='a', [qty]='3' where [id]='1'"
+
+
+def test_render_key_only_projection():
+    template = StatementTemplate('t', tableScheme('id', 'name', 'qty'), keycolumns=[1], columns=['name', 'qty'], keyonly=True)
+    assert template.renderUpdate(["'1'", "'a'", "'4'"], ["'1'", "'a'", "'3'"]) == "update [t] set [qty]='4' where [id]='1'"
+
+
+def test_key_only_without_key_uses_all_columns():
+    template = StatementTemplate('t', tableScheme('id', 'name'), keyonly=True)
+    assert template.renderDelete(["'1'", "'a'"]) == "delete from [t] where [id]='1' and [name]='a'"
+    assert template.renderUpdate(["'1'", "'b'"], ["'1'", "'a'"]) == "update [t] set [id]='1', [name]='b' where [id]='1' and [name]='a'"
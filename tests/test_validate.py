@@ -0,0 +1,84 @@
+import random
+from array import array
+from struct import pack
+
+import pytest
+
+import logfile
+from logfile import _validateHit, validateHits
+
+pytest.importorskip('numpy')
+
+
+def rowRecord(op, partitionid, lengths, previousLSN=(0x20, 0x100, 1), fixedlength=0x3E):
+    record = bytearray(0x40)
+    record[0x02:0x04] = pack('<H', fixedlength)
+    record[0x04:0x0E] = pack('<iih', *previousLSN)
+    record[0x16] = op
+    record[0x30:0x38] = pack('<Q', partitionid)
+    record[0x3E:0x40] = pack('<H', len(lengths))
+    record += b''.join(pack('<H', x) for x in lengths)
+    record += bytes((len(lengths) * 2) % 4)
+    for length in lengths:
+        if length != 0:
+            record += bytes(length + 4 - length % 4)
+    return bytes(record)
+
+
+def xactRecord(op):
+    record = bytearray(0x50 if op == 129 else 0x4C)
+    record[0x02:0x04] = pack('<H', len(record))
+    record[0x16] = op
+    return bytes(record)
+
+
+def makeImage(seed):
+    rand = random.Random(seed)
+    image = bytearray()
+    offsets, ops = array('Q'), array('B')
+    for _ in range(300):
+        kind = rand.randrange(8)
+        if kind == 0:
+            record = xactRecord(rand.choice((128, 129)))
+        elif kind == 1:
+            record = bytes(rand.randrange(256) for _ in range(rand.randrange(0x10, 0x80)))
+        elif kind == 2:
+            record = rowRecord(2, 0x1234, [8], previousLSN=(0, 5, 1)) # invalid previous LSN
+        elif kind == 3:
+            record = rowRecord(3, 0x1234, [4] * (logfile.MAX_NUMELEMENTS + 1))
+        else:
+            record = rowRecord(rand.choice((2, 3, 4)), rand.choice((0x1234, 0x5678)), [rand.randrange(0, 300) for _ in range(rand.randrange(1, 5))])
+        offsets.append(len(image))
+        ops.append(record[0x16] if len(record) > 0x16 and record[0x16] in (2, 3, 4, 128, 129) else rand.choice((2, 128)))
+        image += record
+    # candidate cut short by the end of the image, and one whose row log lengths run past it
+    offsets.append(len(image))
+    ops.append(2)
+    image += rowRecord(2, 0x1234, [8])[:0x38]
+    offsets.append(len(image) - 0x10)
+    ops.append(4)
+    image += rowRecord(4, 0x1234, [16] * 8)[:0x42]
+    return bytes(image), offsets, ops
+
+
+@pytest.mark.parametrize('partitionids', [None, {0x1234}])
+def test_numpy_matches_scalar(partitionids):
+    for seed in range(5):
+        image, offsets, ops = makeImage(seed)
+        scalar = [_validateHit(image, offset, op, partitionids) for offset, op in zip(offsets, ops)]
+        assert validateHits(image, offsets, ops, partitionids) == scalar
+        assert any(scalar) and not all(scalar)
+
+
+def test_numpy_batches(monkeypatch):
+    image, offsets, ops = makeImage(7)
+    expected = validateHits(image, offsets, ops)
+    monkeypatch.setattr(logfile, 'VALIDATE_BATCH', 7)
+    assert validateHits(image, offsets, ops) == expected
+
+
+def test_truncated_row_lengths():
+    record = rowRecord(2, 0x1234, [8, 8])
+    image = record[:0x42] # first length only
+    assert _validateHit(image, 0, 2, None) == False
+    assert validateHits(image, array('Q', [0]), array('B', [2])) == [False]